@@ -1,10 +1,40 @@
+import time
+
+# Отсчет времени холодного старта начинается до остальных импортов
+STARTUP_TIME = time.perf_counter()
+
 import json
 import os
+import queue
+import threading
+from bisect import bisect_right
 from datetime import datetime
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from tkinter import ttk, messagebox, filedialog, simpledialog
+from index import matches_filters
+from backup import BackupStore
+from ledger import Ledger, normalize_date
+from perf import metrics, timed
+from storage import LOAD_ERRORS
+from transfer import content_hash, iter_new_transactions, write_records
+
+# Сколько строк сверх видимых держим в таблице истории
+TREE_OVERSCAN = 10
+
+# Пауза после ввода в поле поиска, после которой обновляется таблица
+SEARCH_DEBOUNCE_MS = 200
+
+# Как часто окно забирает результаты фонового импорта и экспорта
+TRANSFER_POLL_MS = 50
+
+# Цвета темы, которые могут стоять в каждом параметре виджета
+STYLE_ROLES = {
+    "background": ("bg_color", "entry_bg", "button_bg", "tree_bg", "tree_heading_bg"),
+    "foreground": ("fg_color", "tree_fg"),
+    "selectcolor": ("bg_color", "entry_bg")
+}
+
+IMPORT_TIME = time.perf_counter() - STARTUP_TIME
 
 
 class FinanceManager:
@@ -13,21 +43,18 @@ class FinanceManager:
         self.root.title("Личный финансовый менеджер")
         self.root.geometry("1000x600")
 
-        # Инициализация данных
-        self.data_file = "finance_data.json"
-        self.data = {
-            "transactions": [],
-            "categories": {
-                "income": ["Зарплата", "Фриланс", "Инвестиции", "Подарки"],
-                "expense": ["Еда", "Транспорт", "Жилье", "Развлечения", "Одежда"]
-            },
-            "settings": {
-                "theme": "light"
-            }
-        }
+        # Виджеты и цвета темы, которые в них стоят
+        self.style_registry = []
+        self.transfer_job = None
 
         # Загрузка данных
+        load_started = time.perf_counter()
+        self.ledger = Ledger()
         self.load_data()
+        self.startup_report = {
+            "import": IMPORT_TIME,
+            "load_data": time.perf_counter() - load_started
+        }
 
         # Настройка темы
         self.set_theme(self.data["settings"]["theme"])
@@ -35,8 +62,26 @@ class FinanceManager:
         # Создание интерфейса
         self.create_widgets()
 
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        # Время запуска замеряется только по запросу, обычный запуск ничего не выводит
+        report_file = os.environ.get("KOPEECHKA_STARTUP_REPORT")
+        if report_file:
+            self.root.after_idle(self.report_startup, report_file)
+
+    def report_startup(self, report_file):
+        # Первая отрисовка: окно показано и обработаны все отложенные задачи
+        self.root.update_idletasks()
+        self.startup_report["first_paint"] = time.perf_counter() - STARTUP_TIME
+        self.startup_report["transactions"] = self.ledger.count()
+
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(self.startup_report, f, indent=4)
+
+    @property
+    def data(self):
+        return self.ledger.data
+
     def set_theme(self, theme):
-        self.data["settings"]["theme"] = theme
         if theme == "dark":
             self.bg_color = "#2d2d2d"
             self.fg_color = "#ffffff"
@@ -56,28 +101,62 @@ class FinanceManager:
 
         self.root.configure(bg=self.bg_color)
 
+        # Перекрашиваем уже созданные виджеты вместо пересоздания интерфейса
+        alive = []
+        for widget, roles in self.style_registry:
+            if widget.winfo_exists():
+                widget.configure(**{option: getattr(self, role) for option, role in roles.items()})
+                alive.append((widget, roles))
+        self.style_registry = alive
+
+    def register_styles(self, widget):
+        # Запоминаем, какой цвет темы стоит в каждом параметре виджета
+        roles = {}
+        for option, candidates in STYLE_ROLES.items():
+            try:
+                value = widget.cget(option)
+            except tk.TclError:
+                continue
+            for role in candidates:
+                if value == getattr(self, role):
+                    roles[option] = role
+                    break
+        if roles:
+            self.style_registry.append((widget, roles))
+
+        for child in widget.winfo_children():
+            self.register_styles(child)
+
     def create_widgets(self):
         # Создание меню
         self.create_menu()
 
-        # Основные вкладки
+        # Основные вкладки: содержимое вкладки строится при первом ее открытии
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(fill=tk.BOTH, expand=True)
-
-        # Вкладка добавления операций
-        self.create_transaction_tab()
-
-        # Вкладка просмотра операций
-        self.create_history_tab()
-
-        # Вкладка анализа
-        self.create_analysis_tab()
-
-        # Вкладка категорий
-        self.create_categories_tab()
-
-        # Вкладка настроек
-        self.create_settings_tab()
+        self.built_tabs = set()
+        self.tab_builders = {}
+
+        for name, text, builder in (
+                ("transaction", "Добавить операцию", self.create_transaction_tab),
+                ("history", "История операций", self.create_history_tab),
+                ("analysis", "Анализ", self.create_analysis_tab),
+                ("categories", "Категории", self.create_categories_tab),
+                ("settings", "Настройки", self.create_settings_tab)):
+            tab = ttk.Frame(self.notebook)
+            self.notebook.add(tab, text=text)
+            self.tab_builders[str(tab)] = (name, tab, builder)
+
+        self.notebook.bind("<<NotebookTabChanged>>", lambda event: self.build_selected_tab())
+        self.build_selected_tab()
+
+    def build_selected_tab(self):
+        if self.notebook.select() not in self.tab_builders:
+            return
+        name, tab, builder = self.tab_builders.pop(self.notebook.select())
+        self.built_tabs.add(name)
+        builder(tab)
+        self.register_styles(tab)
 
     def create_menu(self):
         menubar = tk.Menu(self.root)
@@ -86,16 +165,15 @@ class FinanceManager:
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Экспорт данных", command=self.export_data)
         file_menu.add_command(label="Импорт данных", command=self.import_data)
+        file_menu.add_command(label="Перенести в SQLite", command=self.migrate_to_sqlite)
+        file_menu.add_command(label="Перенести в двоичный снимок", command=self.migrate_to_binary)
         file_menu.add_separator()
-        file_menu.add_command(label="Выход", command=self.root.quit)
+        file_menu.add_command(label="Выход", command=self.close)
         menubar.add_cascade(label="Файл", menu=file_menu)
 
         self.root.config(menu=menubar)
 
-    def create_transaction_tab(self):
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Добавить операцию")
-
+    def create_transaction_tab(self, tab):
         # Тип операции
         tk.Label(tab, text="Тип операции:", bg=self.bg_color, fg=self.fg_color).grid(row=0, column=0, padx=10, pady=10,
                                                                                      sticky="w")
@@ -146,15 +224,14 @@ class FinanceManager:
         self.transaction_type.trace("w", lambda *args: self.update_category_combobox())
 
     def update_category_combobox(self):
+        if "transaction" not in self.built_tabs:
+            return
         transaction_type = self.transaction_type.get()
         self.category_combobox['values'] = self.data["categories"][transaction_type]
         if self.data["categories"][transaction_type]:
             self.category.set(self.data["categories"][transaction_type][0])
 
-    def create_history_tab(self):
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="История операций")
-
+    def create_history_tab(self, tab):
         # Фильтры
         filter_frame = tk.Frame(tab, bg=self.bg_color)
         filter_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -166,9 +243,10 @@ class FinanceManager:
 
         tk.Label(filter_frame, text="Категория:", bg=self.bg_color, fg=self.fg_color).grid(row=0, column=2, padx=5,
                                                                                            pady=5)
-        self.filter_category = tk.StringVar()
-        ttk.Combobox(filter_frame, textvariable=self.filter_category, state="readonly").grid(row=0, column=3, padx=5,
-                                                                                             pady=5)
+        self.filter_category = tk.StringVar(value="all")
+        self.filter_category_combobox = ttk.Combobox(filter_frame, textvariable=self.filter_category, state="readonly")
+        self.filter_category_combobox.grid(row=0, column=3, padx=5, pady=5)
+        self.update_filter_categories()
 
         tk.Label(filter_frame, text="Дата от:", bg=self.bg_color, fg=self.fg_color).grid(row=0, column=4, padx=5,
                                                                                          pady=5)
@@ -184,9 +262,18 @@ class FinanceManager:
         tk.Button(filter_frame, text="Применить", command=self.apply_filters,
                   bg=self.button_bg, fg=self.fg_color).grid(row=0, column=8, padx=5, pady=5)
 
+        # Поиск по описанию и категории: таблица обновляется по мере ввода
+        tk.Label(filter_frame, text="Поиск:", bg=self.bg_color, fg=self.fg_color).grid(row=1, column=0, padx=5,
+                                                                                       pady=5)
+        self.filter_text = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=self.filter_text, bg=self.entry_bg, fg=self.fg_color).grid(
+            row=1, column=1, columnspan=7, padx=5, pady=5, sticky="we")
+        self.search_job = None
+        self.filter_text.trace("w", lambda *args: self.schedule_search())
+
         # Таблица операций
         columns = ("id", "date", "type", "category", "amount", "description")
-        self.transactions_tree = ttk.Treeview(tab, columns=columns, show="headings", selectmode="browse")
+        self.transactions_tree = ttk.Treeview(tab, columns=columns, show="headings", selectmode="extended")
 
         self.transactions_tree.heading("id", text="ID")
         self.transactions_tree.heading("date", text="Дата")
@@ -202,22 +289,44 @@ class FinanceManager:
         self.transactions_tree.column("amount", width=100, anchor="center")
         self.transactions_tree.column("description", width=250, anchor="w")
 
-        scrollbar = ttk.Scrollbar(tab, orient="vertical", command=self.transactions_tree.yview)
-        self.transactions_tree.configure(yscrollcommand=scrollbar.set)
+        # Таблица виртуальная: в ней есть только видимые строки, а полосой прокрутки
+        # управляем сами, подставляя в те же строки другие операции
+        self.tree_rows = []
+        self.tree_offset = 0
+        # Выделение хранится по id: строки за пределами окна тоже остаются выделенными
+        self.selected_ids = set()
+        self.tree_click_resets = False
+        self.tree_scrollbar = ttk.Scrollbar(tab, orient="vertical", command=self.on_tree_scroll)
+        self.transactions_tree.configure(yscrollcommand=self.on_tree_yview)
+        self.transactions_tree.bind("<Configure>", lambda event: self.render_transactions_window())
+        self.transactions_tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.transactions_tree.bind("<Button-1>", self.on_tree_click)
+
+        # Кнопки действий с выделенными операциями
+        buttons_frame = tk.Frame(tab, bg=self.bg_color)
+        buttons_frame.pack(side="bottom", fill="x", padx=10, pady=10)
+        tk.Button(buttons_frame, text="Выделить все", command=self.select_all_transactions,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", expand=True, fill="x", padx=5)
+        tk.Button(buttons_frame, text="Изменить выбранное", command=self.edit_selected_transactions,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", expand=True, fill="x", padx=5)
+        tk.Button(buttons_frame, text="Удалить выбранное", command=self.delete_selected_transaction,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", expand=True, fill="x", padx=5)
 
         self.transactions_tree.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-
-        # Кнопка удаления
-        tk.Button(tab, text="Удалить выбранное", command=self.delete_selected_transaction,
-                  bg=self.button_bg, fg=self.fg_color).pack(side="bottom", fill="x", padx=10, pady=10)
+        self.tree_scrollbar.pack(side="right", fill="y")
 
         # Обновление таблицы
         self.update_transactions_tree()
 
-    def create_analysis_tab(self):
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Анализ")
+    def update_filter_categories(self):
+        if "history" not in self.built_tabs:
+            return
+        categories = dict.fromkeys(self.data["categories"]["income"] + self.data["categories"]["expense"])
+        self.filter_category_combobox['values'] = ["all"] + list(categories)
+
+    def create_analysis_tab(self, tab):
+        # matplotlib загружается только при первом открытии вкладки анализа
+        from charts import ChartRenderer
 
         # Период анализа
         period_frame = tk.Frame(tab, bg=self.bg_color)
@@ -225,16 +334,19 @@ class FinanceManager:
 
         tk.Label(period_frame, text="Период:", bg=self.bg_color, fg=self.fg_color).pack(side="left", padx=5, pady=5)
         self.analysis_period = tk.StringVar(value="month")
-        ttk.Combobox(period_frame, textvariable=self.analysis_period,
-                     values=["day", "week", "month", "year", "all"], state="readonly").pack(side="left", padx=5, pady=5)
+        period_combobox = ttk.Combobox(period_frame, textvariable=self.analysis_period,
+                                       values=["day", "week", "month", "year", "all"], state="readonly")
+        period_combobox.pack(side="left", padx=5, pady=5)
+        period_combobox.bind("<<ComboboxSelected>>", lambda event: self.update_analysis())
 
         tk.Button(period_frame, text="Обновить", command=self.update_analysis,
                   bg=self.button_bg, fg=self.fg_color).pack(side="left", padx=5, pady=5)
 
         # Графики
-        self.figure = plt.Figure(figsize=(8, 6), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.figure, tab)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # Графики рисуются в фоне и показываются готовой картинкой
+        chart_label = tk.Label(tab, bg=self.bg_color)
+        chart_label.pack(fill=tk.BOTH, expand=True)
+        self.chart_renderer = ChartRenderer(self.root, chart_label)
 
         # Статистика
         stats_frame = tk.Frame(tab, bg=self.bg_color)
@@ -252,10 +364,7 @@ class FinanceManager:
         # Первоначальное обновление анализа
         self.update_analysis()
 
-    def create_categories_tab(self):
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Категории")
-
+    def create_categories_tab(self, tab):
         # Доходы
         tk.Label(tab, text="Категории доходов:", bg=self.bg_color, fg=self.fg_color).pack(pady=(10, 5))
         self.income_categories_listbox = tk.Listbox(tab, bg=self.entry_bg, fg=self.fg_color)
@@ -286,17 +395,18 @@ class FinanceManager:
         tk.Button(expense_frame, text="Добавить", command=lambda: self.add_category("expense"),
                   bg=self.button_bg, fg=self.fg_color).pack(side="left", padx=5)
 
-        # Кнопка удаления
-        tk.Button(tab, text="Удалить выбранные", command=self.delete_selected_categories,
-                  bg=self.button_bg, fg=self.fg_color).pack(fill=tk.X, padx=10, pady=10)
+        # Кнопки переименования и удаления
+        actions_frame = tk.Frame(tab, bg=self.bg_color)
+        actions_frame.pack(fill=tk.X, padx=10, pady=10)
+        tk.Button(actions_frame, text="Переименовать или объединить", command=self.rename_selected_category,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", expand=True, fill="x", padx=5)
+        tk.Button(actions_frame, text="Удалить выбранные", command=self.delete_selected_categories,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", expand=True, fill="x", padx=5)
 
         # Обновление списков категорий
         self.update_categories_lists()
 
-    def create_settings_tab(self):
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Настройки")
-
+    def create_settings_tab(self, tab):
         # Тема
         tk.Label(tab, text="Тема интерфейса:", bg=self.bg_color, fg=self.fg_color).pack(pady=(20, 5))
         self.theme_var = tk.StringVar(value=self.data["settings"]["theme"])
@@ -321,83 +431,354 @@ class FinanceManager:
         tk.Button(backup_frame, text="Восстановить из копии", command=self.restore_from_backup,
                   bg=self.button_bg, fg=self.fg_color).pack(side="left", padx=5, pady=5)
 
+        # Диагностика: время горячих путей и счетчики
+        tk.Label(tab, text="Диагностика:", bg=self.bg_color, fg=self.fg_color).pack(pady=(20, 5))
+
+        diagnostics_frame = tk.Frame(tab, bg=self.bg_color)
+        diagnostics_frame.pack()
+
+        self.metrics_enabled = tk.BooleanVar(value=metrics.enabled)
+        tk.Checkbutton(diagnostics_frame, text="Вести замеры", variable=self.metrics_enabled,
+                       command=self.toggle_metrics, bg=self.bg_color, fg=self.fg_color,
+                       selectcolor=self.bg_color).pack(side="left", padx=5, pady=5)
+        tk.Button(diagnostics_frame, text="Обновить", command=self.update_diagnostics,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", padx=5, pady=5)
+        tk.Button(diagnostics_frame, text="Сбросить", command=self.reset_diagnostics,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", padx=5, pady=5)
+        self.capture_button = tk.Button(diagnostics_frame, text="Начать профилирование",
+                                        command=self.toggle_capture, bg=self.button_bg, fg=self.fg_color)
+        self.capture_button.pack(side="left", padx=5, pady=5)
+        tk.Button(diagnostics_frame, text="Сохранить в JSON", command=self.dump_diagnostics,
+                  bg=self.button_bg, fg=self.fg_color).pack(side="left", padx=5, pady=5)
+
+        self.diagnostics_tree = ttk.Treeview(tab, columns=("calls", "total", "avg", "max"), height=8)
+        self.diagnostics_tree.heading("#0", text="Замер")
+        self.diagnostics_tree.heading("calls", text="Вызовов")
+        self.diagnostics_tree.heading("total", text="Всего, мс")
+        self.diagnostics_tree.heading("avg", text="Среднее, мс")
+        self.diagnostics_tree.heading("max", text="Максимум, мс")
+        for column in ("calls", "total", "avg", "max"):
+            self.diagnostics_tree.column(column, width=100, anchor="e")
+        self.diagnostics_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        self.update_diagnostics()
+
+    def toggle_metrics(self):
+        metrics.enabled = self.metrics_enabled.get()
+
+    def update_diagnostics(self):
+        report = metrics.report()
+        self.diagnostics_tree.delete(*self.diagnostics_tree.get_children())
+        for name, timer in sorted(report["timers"].items(), key=lambda item: -item[1]["total_ms"]):
+            self.diagnostics_tree.insert("", tk.END, text=name, values=(
+                timer["calls"], f"{timer['total_ms']:.1f}", f"{timer['avg_ms']:.2f}", f"{timer['max_ms']:.2f}"))
+        for name, value in sorted(report["counters"].items()):
+            self.diagnostics_tree.insert("", tk.END, text=name, values=(value, "", "", ""))
+
+        capture = report["capture"]
+        if capture:
+            self.diagnostics_tree.insert("", tk.END, text="Пик памяти при профилировании, КБ",
+                                         values=(capture["memory_peak_kb"], "", "", ""))
+
+    def reset_diagnostics(self):
+        metrics.reset()
+        self.update_diagnostics()
+
+    def toggle_capture(self):
+        # Профилирование включает и замеры: иначе в отчете не будет времени горячих путей
+        if metrics.capturing:
+            metrics.stop_capture()
+            self.capture_button.config(text="Начать профилирование")
+            self.update_diagnostics()
+            messagebox.showinfo("Профилирование", "Профиль записан, сохраните отчет в JSON для просмотра")
+        else:
+            metrics.enabled = True
+            self.metrics_enabled.set(True)
+            metrics.start_capture()
+            self.capture_button.config(text="Остановить профилирование")
+
+    def dump_diagnostics(self):
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            title="Сохранить отчет диагностики"
+        )
+
+        if file_path:
+            try:
+                metrics.dump(file_path)
+                messagebox.showinfo("Успех", "Отчет диагностики сохранен")
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить отчет: {str(e)}")
+
     def change_theme(self):
+        self.ledger.set_theme(self.theme_var.get())
         self.set_theme(self.theme_var.get())
-        self.save_data()
-        # Пересоздаем интерфейс для применения новой темы
-        for child in self.root.winfo_children():
-            child.destroy()
-        self.create_widgets()
 
     def add_transaction(self):
         try:
-            transaction = {
-                "id": len(self.data["transactions"]) + 1,
-                "date": self.date.get(),
-                "type": self.transaction_type.get(),
-                "category": self.category.get(),
-                "amount": float(self.amount.get()),
-                "description": self.description.get()
-            }
-
-            self.data["transactions"].append(transaction)
-            self.save_data()
+            transaction = self.ledger.add(self.date.get(), self.transaction_type.get(), self.category.get(),
+                                          self.amount.get(), self.description.get())
 
             # Очистка полей
             self.amount.set(0)
             self.description.set("")
 
             # Обновление таблицы
-            self.update_transactions_tree()
+            self.insert_tree_row(transaction)
             self.update_analysis()
+            self.update_categories_lists()
 
             messagebox.showinfo("Успех", "Операция успешно добавлена")
         except ValueError:
             messagebox.showerror("Ошибка", "Проверьте правильность введенных данных")
 
+    @timed("update_transactions_tree")
     def update_transactions_tree(self):
-        # Очистка таблицы
-        for item in self.transactions_tree.get_children():
-            self.transactions_tree.delete(item)
-
-        # Заполнение таблицы
-        for transaction in self.data["transactions"]:
-            self.transactions_tree.insert("", "end", values=(
-                transaction["id"],
-                transaction["date"],
-                "Доход" if transaction["type"] == "income" else "Расход",
-                transaction["category"],
-                f"{transaction['amount']:.2f}",
-                transaction["description"]
-            ))
+        try:
+            self.tree_filters = self.get_filters()
+        except ValueError:
+            # Неверная дата в поле еще не применена — остаются последние проверенные фильтры
+            pass
+        self.tree_offset = 0
+        self.refresh_transactions_tree()
+
+    @timed("refresh_transactions_tree")
+    def refresh_transactions_tree(self):
+        # Повторная выборка с теми же фильтрами и без сброса прокрутки
+        if "history" not in self.built_tabs:
+            return
+        self.tree_rows = self.ledger.query(**self.tree_filters)
+        metrics.count("query_rows", len(self.tree_rows))
+        self.render_transactions_window()
+
+    def tree_visible_rows(self):
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        return max(1, self.transactions_tree.winfo_height() // row_height)
+
+    @timed("render_transactions_window")
+    def render_transactions_window(self):
+        visible = self.tree_visible_rows()
+        total = len(self.tree_rows)
+        self.tree_offset = max(0, min(self.tree_offset, total - visible))
+        window = self.tree_rows[self.tree_offset:self.tree_offset + visible + TREE_OVERSCAN]
+
+        # Id строки таблицы — это id операции: уже показанные строки только
+        # переставляются, удаляются лишь ушедшие из окна
+        iids = [str(transaction["id"]) for transaction in window]
+        metrics.count("rows_rendered", len(window))
+        shown = set(iids)
+        for iid in self.transactions_tree.get_children():
+            if iid not in shown:
+                self.transactions_tree.delete(iid)
+        for n, (iid, transaction) in enumerate(zip(iids, window)):
+            values = self.format_transaction_row(transaction)
+            if self.transactions_tree.exists(iid):
+                self.transactions_tree.item(iid, values=values)
+                self.transactions_tree.move(iid, "", n)
+            else:
+                self.transactions_tree.insert("", n, iid=iid, values=values)
+
+        # Выделение следует за операцией, а не за строкой таблицы
+        self.transactions_tree.selection_set([iid for iid in iids if int(iid) in self.selected_ids])
+
+        self.transactions_tree.yview_moveto(0)
+        if total:
+            self.tree_scrollbar.set(self.tree_offset / total, min(1.0, (self.tree_offset + visible) / total))
+        else:
+            self.tree_scrollbar.set(0, 1)
+
+    def format_transaction_row(self, transaction):
+        return (
+            transaction["id"],
+            transaction["date"],
+            "Доход" if transaction["type"] == "income" else "Расход",
+            transaction["category"],
+            f"{transaction['amount']:.2f}",
+            transaction["description"]
+        )
+
+    def scroll_transactions_tree(self, offset):
+        if offset != self.tree_offset:
+            self.tree_offset = offset
+            self.render_transactions_window()
+
+    def on_tree_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            offset = int(float(amount) * len(self.tree_rows))
+        elif unit == "pages":
+            offset = self.tree_offset + int(amount) * self.tree_visible_rows()
+        else:
+            offset = self.tree_offset + int(amount)
+        self.scroll_transactions_tree(offset)
+
+    def on_tree_yview(self, first, last):
+        # Колесо мыши и клавиши прокручивают запасные строки внутри таблицы —
+        # переводим этот сдвиг в смещение окна
+        shift = round(float(first) * len(self.transactions_tree.get_children()))
+        if shift > 0:
+            self.scroll_transactions_tree(self.tree_offset + shift)
+
+    def on_tree_click(self, event):
+        # Щелчок без Shift и Ctrl заменяет выделение целиком, в том числе за пределами окна
+        self.tree_click_resets = not event.state & 0x0005
+
+    def on_tree_select(self, event):
+        selected = {int(iid) for iid in self.transactions_tree.selection()}
+        if self.tree_click_resets:
+            self.tree_click_resets = False
+            self.selected_ids = selected
+        else:
+            visible = {int(iid) for iid in self.transactions_tree.get_children()}
+            self.selected_ids = (self.selected_ids - visible) | selected
+
+    def select_all_transactions(self):
+        # Все операции текущей выборки фильтра, а не только видимые строки
+        self.selected_ids = set(self.tree_rows.ids())
+        self.render_transactions_window()
+
+    def insert_tree_row(self, transaction):
+        if "history" not in self.built_tabs:
+            return
+        if matches_filters(transaction, **self.tree_filters):
+            position = bisect_right(self.tree_rows, transaction["date"], key=lambda t: t["date"])
+            self.tree_rows.insert(position, transaction)
+            self.render_transactions_window()
+
+    def remove_tree_row(self, transaction):
+        if "history" not in self.built_tabs:
+            return
+        index = self.tree_rows.find(transaction)
+        if index is not None:
+            del self.tree_rows[index]
+            self.render_transactions_window()
+
+    def get_filters(self):
+        filters = {
+            "transaction_type": self.filter_type.get(),
+            "category": self.filter_category.get(),
+            "date_from": self.filter_date_from.get().strip(),
+            "date_to": self.filter_date_to.get().strip(),
+            "text": self.filter_text.get().strip()
+        }
+        # Значение "all" означает отсутствие фильтра
+        filters = {key: (None if value in ("", "all") else value) for key, value in filters.items()}
+        # Индекс и SQLite сравнивают даты в ISO-записи, поэтому 2024-3-1 приводим к 2024-03-01
+        for key in ("date_from", "date_to"):
+            if filters[key] is not None:
+                filters[key] = normalize_date(filters[key])
+        return filters
+
+    def schedule_search(self):
+        # Несколько нажатий подряд дают одну выборку
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DEBOUNCE_MS, self.run_search)
+
+    def run_search(self):
+        self.search_job = None
+        # Поиск применяется вместе с остальными фильтрами, даты берутся последние проверенные
+        self.tree_filters["text"] = self.filter_text.get().strip() or None
+        self.tree_offset = 0
+        self.refresh_transactions_tree()
 
     def apply_filters(self):
-        # В реальном приложении здесь бы применялись фильтры к данным
-        # Для простоты просто обновляем таблицу
+        try:
+            self.get_filters()
+        except ValueError:
+            messagebox.showerror("Ошибка", "Дата должна быть в формате ГГГГ-ММ-ДД")
+            return
+
         self.update_transactions_tree()
 
     def delete_selected_transaction(self):
-        selected = self.transactions_tree.selection()
-        if not selected:
+        if not self.selected_ids:
             messagebox.showwarning("Внимание", "Выберите операцию для удаления")
             return
+        if len(self.selected_ids) > 1 and not messagebox.askyesno(
+                "Подтверждение", f"Удалить выбранные операции ({len(self.selected_ids)})?"):
+            return
 
-        selected_id = int(self.transactions_tree.item(selected[0], "values")[0])
-
-        # Удаление операции
-        self.data["transactions"] = [t for t in self.data["transactions"] if t["id"] != selected_id]
-        self.save_data()
+        # Удаление одной пачкой: одна запись в файл, одно обновление индекса и сумм
+        removed = self.ledger.delete_many(sorted(self.selected_ids))
+        self.selected_ids = set()
 
         # Обновление таблицы
-        self.update_transactions_tree()
+        if len(removed) == 1:
+            self.remove_tree_row(removed[0])
+        else:
+            self.refresh_transactions_tree()
         self.update_analysis()
+        self.update_categories_lists()
+
+        messagebox.showinfo("Успех", f"Удалено операций: {len(removed)}")
+
+    def edit_selected_transactions(self):
+        if not self.selected_ids:
+            messagebox.showwarning("Внимание", "Выберите операции для изменения")
+            return
 
-        messagebox.showinfo("Успех", "Операция успешно удалена")
+        window = tk.Toplevel(self.root, bg=self.bg_color)
+        window.title(f"Изменить операции ({len(self.selected_ids)})")
+        window.transient(self.root)
+        window.resizable(False, False)
+        window.grab_set()
+
+        # Пустое поле означает "не менять"
+        edit_type = tk.StringVar()
+        edit_category = tk.StringVar()
+        edit_date = tk.StringVar()
+
+        def update_categories(event=None):
+            types = [edit_type.get()] if edit_type.get() else ["income", "expense"]
+            category_combobox["values"] = [""] + [c for t in types for c in self.data["categories"][t]]
+
+        tk.Label(window, text="Тип:", bg=self.bg_color, fg=self.fg_color).grid(row=0, column=0, padx=5, pady=5)
+        type_combobox = ttk.Combobox(window, textvariable=edit_type, values=["", "income", "expense"],
+                                     state="readonly")
+        type_combobox.grid(row=0, column=1, padx=5, pady=5)
+        type_combobox.bind("<<ComboboxSelected>>", update_categories)
+
+        tk.Label(window, text="Категория:", bg=self.bg_color, fg=self.fg_color).grid(row=1, column=0, padx=5, pady=5)
+        category_combobox = ttk.Combobox(window, textvariable=edit_category)
+        category_combobox.grid(row=1, column=1, padx=5, pady=5)
+        update_categories()
+
+        tk.Label(window, text="Дата (ГГГГ-ММ-ДД):", bg=self.bg_color, fg=self.fg_color).grid(row=2, column=0,
+                                                                                             padx=5, pady=5)
+        tk.Entry(window, textvariable=edit_date, bg=self.entry_bg, fg=self.fg_color).grid(row=2, column=1,
+                                                                                          padx=5, pady=5)
+
+        def apply_changes():
+            try:
+                updated = self.ledger.update_many(sorted(self.selected_ids), type=edit_type.get(),
+                                                  category=edit_category.get().strip(),
+                                                  date=edit_date.get().strip())
+            except ValueError:
+                messagebox.showerror("Ошибка", "Проверьте правильность введенных данных", parent=window)
+                return
+            window.destroy()
+
+            # Одно обновление интерфейса на всю пачку
+            self.update_category_combobox()
+            self.update_filter_categories()
+            self.update_categories_lists()
+            self.refresh_transactions_tree()
+            self.update_analysis()
+            messagebox.showinfo("Успех", f"Изменено операций: {len(updated)}")
 
+        tk.Button(window, text="Применить", command=apply_changes,
+                  bg=self.button_bg, fg=self.fg_color).grid(row=3, column=0, columnspan=2, pady=10)
+
+    @timed("update_analysis")
     def update_analysis(self):
-        # Расчет статистики
-        total_income = sum(t["amount"] for t in self.data["transactions"] if t["type"] == "income")
-        total_expense = sum(t["amount"] for t in self.data["transactions"] if t["type"] == "expense")
+        if "analysis" not in self.built_tabs:
+            return
+        # Статистика берется из готовых сумм за выбранный период
+        period = self.analysis_period.get()
+        totals = self.ledger.totals(period)
+        total_income = totals["income"]
+        total_expense = totals["expense"]
         balance = total_income - total_expense
 
         # Обновление меток
@@ -405,32 +786,11 @@ class FinanceManager:
         self.total_expense_label.config(text=f"Расходы: {total_expense:.2f}")
         self.balance_label.config(text=f"Баланс: {balance:.2f}")
 
-        # Создание графиков
-        self.figure.clear()
-
-        # График доходов по категориям
-        income_data = {}
-        for t in self.data["transactions"]:
-            if t["type"] == "income":
-                income_data[t["category"]] = income_data.get(t["category"], 0) + t["amount"]
-
-        if income_data:
-            ax1 = self.figure.add_subplot(121)
-            ax1.pie(income_data.values(), labels=income_data.keys(), autopct="%1.1f%%")
-            ax1.set_title("Доходы по категориям")
-
-        # График расходов по категориям
-        expense_data = {}
-        for t in self.data["transactions"]:
-            if t["type"] == "expense":
-                expense_data[t["category"]] = expense_data.get(t["category"], 0) + t["amount"]
-
-        if expense_data:
-            ax2 = self.figure.add_subplot(122)
-            ax2.pie(expense_data.values(), labels=expense_data.keys(), autopct="%1.1f%%")
-            ax2.set_title("Расходы по категориям")
-
-        self.canvas.draw()
+        # Создание графиков: серия изменений подряд даст одну фоновую перерисовку.
+        # Динамика строится по готовым суммам корзин, число операций на нее не влияет
+        self.chart_renderer.request(self.ledger.category_sums("income", period),
+                                    self.ledger.category_sums("expense", period),
+                                    self.ledger.series(period))
 
     def add_category(self, category_type):
         if category_type == "income":
@@ -438,17 +798,12 @@ class FinanceManager:
         else:
             new_category = self.new_expense_category.get().strip()
 
-        if not new_category:
-            messagebox.showwarning("Внимание", "Введите название категории")
-            return
-
-        if new_category in self.data["categories"][category_type]:
-            messagebox.showwarning("Внимание", "Такая категория уже существует")
+        try:
+            self.ledger.add_category(category_type, new_category)
+        except ValueError as e:
+            messagebox.showwarning("Внимание", str(e))
             return
 
-        self.data["categories"][category_type].append(new_category)
-        self.save_data()
-
         if category_type == "income":
             self.new_income_category.set("")
         else:
@@ -456,53 +811,178 @@ class FinanceManager:
 
         self.update_categories_lists()
         self.update_category_combobox()
+        self.update_filter_categories()
 
         messagebox.showinfo("Успех", "Категория успешно добавлена")
 
     def update_categories_lists(self):
-        self.income_categories_listbox.delete(0, tk.END)
-        for category in self.data["categories"]["income"]:
-            self.income_categories_listbox.insert(tk.END, category)
-
-        self.expense_categories_listbox.delete(0, tk.END)
-        for category in self.data["categories"]["expense"]:
-            self.expense_categories_listbox.insert(tk.END, category)
+        if "categories" not in self.built_tabs:
+            return
+        # Рядом с категорией показываем, сколько в ней операций
+        for category_type, listbox in (("income", self.income_categories_listbox),
+                                       ("expense", self.expense_categories_listbox)):
+            counts = self.ledger.category_counts(category_type)
+            listbox.delete(0, tk.END)
+            for category in self.data["categories"][category_type]:
+                listbox.insert(tk.END, f"{category} ({counts.get(category, 0)})")
+
+    def selected_categories(self):
+        # Строки списков подписаны числом операций, поэтому название берем по позиции
+        selected = []
+        for category_type, listbox in (("income", self.income_categories_listbox),
+                                       ("expense", self.expense_categories_listbox)):
+            selection = listbox.curselection()
+            if selection:
+                selected.append((category_type, self.data["categories"][category_type][selection[0]]))
+        return selected
 
     def delete_selected_categories(self):
-        # Удаление выбранных категорий доходов
-        selected_income = self.income_categories_listbox.curselection()
-        if selected_income:
-            category = self.income_categories_listbox.get(selected_income[0])
-            self.data["categories"]["income"].remove(category)
-
-        # Удаление выбранных категорий расходов
-        selected_expense = self.expense_categories_listbox.curselection()
-        if selected_expense:
-            category = self.expense_categories_listbox.get(selected_expense[0])
-            self.data["categories"]["expense"].remove(category)
-
-        self.save_data()
+        selected = self.selected_categories()
+        try:
+            self.ledger.remove_categories(selected)
+        except ValueError as e:
+            messagebox.showwarning("Внимание", str(e))
+            return
         self.update_categories_lists()
         self.update_category_combobox()
+        self.update_filter_categories()
 
         messagebox.showinfo("Успех", "Выбранные категории удалены")
 
+    def rename_selected_category(self):
+        selected = self.selected_categories()
+        if len(selected) != 1:
+            messagebox.showwarning("Внимание", "Выберите одну категорию")
+            return
+        category_type, old = selected[0]
+
+        new = simpledialog.askstring("Переименование", f"Новое название категории «{old}»:",
+                                     initialvalue=old, parent=self.root)
+        if new is None or new.strip() == old:
+            return
+        new = new.strip()
+        # Существующее название означает слияние: операции переходят в ту категорию
+        merge = new in self.ledger.category_sets[category_type]
+        if merge and not messagebox.askyesno("Подтверждение", f"Категория «{new}» уже есть. "
+                                                               f"Перенести в нее операции из «{old}»?"):
+            return
+
+        try:
+            moved = self.ledger.rename_category(category_type, old, new, merge=merge)
+        except ValueError as e:
+            messagebox.showwarning("Внимание", str(e))
+            return
+
+        if "history" in self.built_tabs and self.filter_category.get() == old:
+            self.filter_category.set(new)
+            self.tree_filters["category"] = new
+        self.update_categories_lists()
+        self.update_category_combobox()
+        self.update_filter_categories()
+        self.refresh_transactions_tree()
+        self.update_analysis()
+
+        messagebox.showinfo("Успех", f"Категория обновлена, операций перенесено: {moved}")
+
+    def ask_backup_dir(self, title):
+        directory = self.ledger.backup_dir()
+        return filedialog.askdirectory(initialdir=directory if os.path.isdir(directory) else
+                                       os.path.dirname(directory), title=title)
+
     def create_backup(self):
-        file_path = filedialog.asksaveasfilename(
-            defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
-            title="Сохранить резервную копию"
-        )
+        # Копия инкрементная: на диск пишутся только месяцы, изменившиеся с прошлого снимка
+        directory = self.ask_backup_dir("Каталог резервных копий")
+        if not directory or not self.start_transfer("Резервное копирование"):
+            return
+        job = self.transfer_job
+        job["total"] = self.ledger.count()
+        job["counter"] = {"rows": 0, "written": 0}
+        threading.Thread(target=self.backup_worker,
+                         args=(BackupStore(directory), self.ledger.backup_meta(), self.ledger.export_rows(), job),
+                         daemon=True).start()
+        self.root.after(TRANSFER_POLL_MS, self.poll_backup)
+
+    def backup_worker(self, store, meta, rows, job):
+        try:
+            store.create(meta, rows, job["counter"])
+            job["queue"].put(None)
+        except Exception as e:
+            job["queue"].put(e)
 
-        if file_path:
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    json.dump(self.data, f, ensure_ascii=False, indent=4)
-                messagebox.showinfo("Успех", "Резервная копия успешно создана")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось создать резервную копию: {str(e)}")
+    def poll_backup(self):
+        job = self.transfer_job
+        try:
+            result = job["queue"].get_nowait()
+        except queue.Empty:
+            self.update_transfer_progress(job["counter"]["rows"], job["total"],
+                                          f"Прочитано операций: {job['counter']['rows']}")
+            self.root.after(TRANSFER_POLL_MS, self.poll_backup)
+            return
+
+        self.finish_transfer()
+        counter = job["counter"]
+        if result is None:
+            messagebox.showinfo("Успех", f"Резервная копия создана: {counter['rows']} операций, "
+                                         f"новых месяцев {counter['written']} из {counter['chunks']} "
+                                         f"({counter['bytes'] // 1024} КБ)")
+        else:
+            messagebox.showerror("Ошибка", f"Не удалось создать резервную копию: {str(result)}")
 
     def restore_from_backup(self):
+        directory = self.ask_backup_dir("Каталог резервных копий")
+        if not directory:
+            return
+        store = BackupStore(directory)
+        try:
+            snapshots = store.snapshots()
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось прочитать резервные копии: {str(e)}")
+            return
+
+        window = tk.Toplevel(self.root, bg=self.bg_color)
+        window.title("Восстановление из копии")
+        window.transient(self.root)
+        tk.Label(window, text="Снимки (новые сверху):", bg=self.bg_color, fg=self.fg_color).pack(
+            padx=10, pady=(10, 5), anchor="w")
+        listbox = tk.Listbox(window, width=45, height=10, bg=self.entry_bg, fg=self.fg_color)
+        listbox.pack(padx=10, fill=tk.BOTH, expand=True)
+        names = []
+        for name, manifest in reversed(snapshots):
+            names.append(name)
+            listbox.insert(tk.END, f"{manifest['created'].replace('T', ' ')} — операций: {manifest['rows']}")
+        if names:
+            listbox.selection_set(0)
+
+        def restore():
+            selection = listbox.curselection()
+            if not selection:
+                messagebox.showwarning("Внимание", "Выберите снимок", parent=window)
+                return
+            window.destroy()
+            self.restore_snapshot(store, names[selection[0]])
+
+        def restore_file():
+            window.destroy()
+            self.restore_from_file()
+
+        buttons = tk.Frame(window, bg=self.bg_color)
+        buttons.pack(pady=10)
+        tk.Button(buttons, text="Восстановить", command=restore, bg=self.button_bg,
+                  fg=self.fg_color).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Из файла JSON...", command=restore_file, bg=self.button_bg,
+                  fg=self.fg_color).pack(side=tk.LEFT, padx=5)
+
+    def restore_snapshot(self, store, name):
+        try:
+            # Куски проверяются по хешу до замены данных: поврежденная копия ничего не затрет
+            self.ledger.replace(store.restore(name))
+            self.reload_data_views()
+            messagebox.showinfo("Успех", "Данные успешно восстановлены из резервной копии")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось восстановить данные: {str(e)}")
+
+    def restore_from_file(self):
+        # Копии прежнего формата — один JSON-файл со всеми данными
         file_path = filedialog.askopenfilename(
             filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
             title="Выберите резервную копию для восстановления"
@@ -511,13 +991,9 @@ class FinanceManager:
         if file_path:
             try:
                 with open(file_path, "r", encoding="utf-8") as f:
-                    self.data = json.load(f)
-                self.save_data()
+                    self.ledger.replace(json.load(f))
 
-                # Пересоздаем интерфейс для применения новых данных
-                for child in self.root.winfo_children():
-                    child.destroy()
-                self.create_widgets()
+                self.reload_data_views()
 
                 messagebox.showinfo("Успех", "Данные успешно восстановлены из резервной копии")
             except Exception as e:
@@ -525,54 +1001,196 @@ class FinanceManager:
 
     def export_data(self):
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("JSON Lines", "*.jsonl"), ("JSON files", "*.json"),
+                       ("All files", "*.*")],
             title="Экспорт данных"
         )
 
-        if file_path:
+        if not file_path:
+            return
+
+        if os.path.splitext(file_path)[1].lower() == ".json":
             try:
                 with open(file_path, "w", encoding="utf-8") as f:
-                    json.dump(self.data, f, ensure_ascii=False, indent=4)
+                    json.dump(self.ledger.export(), f, ensure_ascii=False, indent=4)
                 messagebox.showinfo("Успех", "Данные успешно экспортированы")
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось экспортировать данные: {str(e)}")
+            return
+
+        if not self.start_transfer("Экспорт данных"):
+            return
+        job = self.transfer_job
+        job["total"] = self.ledger.count()
+        job["counter"] = {"rows": 0}
+        threading.Thread(target=self.export_worker, args=(file_path, self.ledger.export_rows(), job),
+                         daemon=True).start()
+        self.root.after(TRANSFER_POLL_MS, self.poll_export)
+
+    def export_worker(self, file_path, rows, job):
+        try:
+            write_records(file_path, rows, job["counter"])
+            job["queue"].put(None)
+        except Exception as e:
+            job["queue"].put(e)
+
+    def poll_export(self):
+        job = self.transfer_job
+        try:
+            result = job["queue"].get_nowait()
+        except queue.Empty:
+            self.update_transfer_progress(job["counter"]["rows"], job["total"],
+                                          f"Записано операций: {job['counter']['rows']}")
+            self.root.after(TRANSFER_POLL_MS, self.poll_export)
+            return
+
+        self.finish_transfer()
+        if result is None:
+            messagebox.showinfo("Успех", f"Данные успешно экспортированы: {job['counter']['rows']} операций")
+        else:
+            messagebox.showerror("Ошибка", f"Не удалось экспортировать данные: {str(result)}")
 
     def import_data(self):
         file_path = filedialog.askopenfilename(
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            filetypes=[("Поддерживаемые файлы", "*.csv *.jsonl *.ndjson *.json"), ("CSV files", "*.csv"),
+                       ("JSON Lines", "*.jsonl *.ndjson"), ("JSON files", "*.json"), ("All files", "*.*")],
             title="Импорт данных"
         )
 
-        if file_path:
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    self.data = json.load(f)
-                self.save_data()
-
-                # Пересоздаем интерфейс для применения новых данных
-                for child in self.root.winfo_children():
-                    child.destroy()
-                self.create_widgets()
-
-                messagebox.showinfo("Успех", "Данные успешно импортированы")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось импортировать данные: {str(e)}")
+        if not file_path or not self.start_transfer("Импорт данных"):
+            return
 
-    def load_data(self):
-        if os.path.exists(self.data_file):
+        # Очередь ограничена, поэтому в памяти не больше нескольких пачек файла
+        job = self.transfer_job
+        job["queue"] = queue.Queue(maxsize=4)
+        job["total"] = os.path.getsize(file_path)
+        job["counter"] = {"bytes": 0, "errors": 0, "duplicates": 0}
+        job["added"] = 0
+        threading.Thread(target=self.import_worker, args=(file_path, self.ledger.export_rows(), job),
+                         daemon=True).start()
+        self.root.after(TRANSFER_POLL_MS, self.poll_import)
+
+    def import_worker(self, file_path, existing_rows, job):
+        try:
+            existing = {content_hash(t) for t in existing_rows}
+            for chunk in iter_new_transactions(file_path, existing, job["counter"]):
+                job["queue"].put(chunk)
+            job["queue"].put(None)
+        except Exception as e:
+            job["queue"].put(e)
+
+    def poll_import(self):
+        job = self.transfer_job
+        # Не больше двух пачек за раз, чтобы окно оставалось отзывчивым
+        for _ in range(2):
             try:
-                with open(self.data_file, "r", encoding="utf-8") as f:
-                    self.data = json.load(f)
-            except:
-                # Если файл поврежден, создаем новый с данными по умолчанию
-                self.save_data()
+                chunk = job["queue"].get_nowait()
+            except queue.Empty:
+                break
+            if chunk is None or isinstance(chunk, Exception):
+                self.finish_import(chunk)
+                return
+            self.merge_transactions(chunk, job)
+
+        self.update_transfer_progress(job["counter"]["bytes"], job["total"],
+                                      f"Добавлено операций: {job['added']}")
+        self.root.after(TRANSFER_POLL_MS, self.poll_import)
+
+    def merge_transactions(self, transactions, job):
+        self.ledger.add_many(transactions)
+        job["added"] += len(transactions)
+
+    def finish_import(self, error):
+        job = self.transfer_job
+        self.finish_transfer()
+        self.reload_data_views()
+
+        summary = (f"Добавлено: {job['added']}, дубликатов: {job['counter']['duplicates']}, "
+                   f"ошибок: {job['counter']['errors']}")
+        if error is None:
+            messagebox.showinfo("Успех", f"Данные успешно импортированы. {summary}")
         else:
-            self.save_data()
+            messagebox.showerror("Ошибка", f"Не удалось импортировать данные: {str(error)}. {summary}")
+
+    def start_transfer(self, title):
+        if self.transfer_job is not None:
+            messagebox.showwarning("Внимание", "Дождитесь завершения текущего импорта или экспорта")
+            return False
+
+        window = tk.Toplevel(self.root, bg=self.bg_color)
+        window.title(title)
+        window.transient(self.root)
+        window.resizable(False, False)
+        # Закрыть окно до завершения нельзя: работа продолжается в фоне
+        window.protocol("WM_DELETE_WINDOW", lambda: None)
+        label = tk.Label(window, text="Подготовка...", bg=self.bg_color, fg=self.fg_color)
+        label.pack(padx=20, pady=(15, 5))
+        progress = ttk.Progressbar(window, length=300, maximum=100)
+        progress.pack(padx=20, pady=(5, 15))
+
+        self.transfer_job = {"queue": queue.Queue(), "window": window, "label": label, "progress": progress}
+        return True
+
+    def update_transfer_progress(self, done, total, text):
+        job = self.transfer_job
+        job["progress"]["value"] = 100 * done / total if total else 0
+        job["label"].config(text=text)
+
+    def finish_transfer(self):
+        self.transfer_job["window"].destroy()
+        self.transfer_job = None
+
+    @timed("load_data")
+    def load_data(self):
+        try:
+            self.ledger.load()
+        except LOAD_ERRORS:
+            # Если файл поврежден, сохраняем его копию и начинаем с данных по умолчанию
+            broken_file = self.ledger.quarantine()
+            messagebox.showwarning("Внимание", f"Файл данных поврежден и сохранен как {broken_file}")
+
+    def reload_data_views(self):
+        # После смены данных обновляем только зависящие от них представления,
+        # виджеты и фигура графиков остаются прежними
+        self.set_theme(self.data["settings"].get("theme", "light"))
+        if "settings" in self.built_tabs:
+            self.theme_var.set(self.data["settings"]["theme"])
+        self.update_category_combobox()
+        self.update_filter_categories()
+        self.update_categories_lists()
+        if "history" in self.built_tabs:
+            self.selected_ids = set()
+            self.update_transactions_tree()
+        self.update_analysis()
 
-    def save_data(self):
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=4)
+    def migrate_to_sqlite(self):
+        try:
+            db_file = self.ledger.migrate_to_sqlite()
+            # Выборка таблицы и суммы ссылаются на прежнее хранилище
+            self.reload_data_views()
+            messagebox.showinfo("Успех", f"Данные перенесены в {db_file}")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось перенести данные: {str(e)}")
+
+    def migrate_to_binary(self):
+        try:
+            binary_file = self.ledger.migrate_to_binary()
+            # Выборка таблицы и суммы ссылаются на прежнее хранилище
+            self.reload_data_views()
+            messagebox.showinfo("Успех", f"Данные перенесены в {binary_file}")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось перенести данные: {str(e)}")
+
+    def close(self):
+        # Изменения пишутся на диск в фоне; закрытие дожидается записи всего накопленного
+        try:
+            self.ledger.close()
+        except OSError as e:
+            if not messagebox.askyesno("Ошибка", f"Не удалось сохранить данные: {str(e)}\n"
+                                                 "Закрыть программу без сохранения последних изменений?"):
+                return
+        self.root.destroy()
 
 
 if __name__ == "__main__":
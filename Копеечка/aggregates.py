@@ -0,0 +1,191 @@
+from datetime import date as Date, timedelta
+
+from money import to_kopecks, to_rubles
+
+PERIODS = ("day", "week", "month", "year")
+
+# Сколько последних корзин показывает график динамики
+TREND_BUCKETS = {"day": 31, "week": 26, "month": 24, "year": 10}
+
+
+def period_key(date, period):
+    # Ключ корзины периода для даты в ISO-формате
+    if period == "day":
+        return date
+    if period == "month":
+        return date[:7]
+    if period == "year":
+        return date[:4]
+    try:
+        year, week, weekday = Date.fromisoformat(date).isocalendar()
+    except ValueError:
+        return None
+    return f"{year:04d}-W{week:02d}"
+
+
+def bucket_keys(period, date, count):
+    # Ключи count последних корзин периода подряд, заканчивая корзиной даты
+    day = Date.fromisoformat(date)
+    keys = []
+    for _ in range(count):
+        keys.append(period_key(day.isoformat(), period))
+        if period == "day":
+            day -= timedelta(days=1)
+        elif period == "week":
+            day -= timedelta(days=7)
+        elif period == "month":
+            day = day.replace(day=1) - timedelta(days=1)
+        else:
+            day = day.replace(month=1, day=1) - timedelta(days=1)
+    return keys[::-1]
+
+
+def add_to(sums, key, amount, count):
+    entry = sums.setdefault(key, [0, 0])
+    entry[0] += amount
+    entry[1] += count
+    # Пустые записи убираем, чтобы на графиках не оставались нулевые категории
+    if entry[1] <= 0:
+        del sums[key]
+
+
+def move_key(sums, old_key, new_key):
+    # Суммы категории переходят к другой, при слиянии складываясь с ее суммами
+    entry = sums.pop(old_key, None)
+    if entry is not None:
+        target = sums.setdefault(new_key, [0, 0])
+        target[0] += entry[0]
+        target[1] += entry[1]
+
+
+def group_rows(rows):
+    # Строки сумм по периодам: снимки хранят каждый период отдельно, чтобы при запуске
+    # читать только итоги за все время
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(row)
+    return groups
+
+
+class Aggregates:
+    def __init__(self, daily_sums=()):
+        # period -> корзина -> (тип, категория) -> [сумма в копейках, количество].
+        # Суммы — целые числа, поэтому сколько бы изменений ни прошло, они совпадают с операциями до копейки
+        self.buckets = {period: {} for period in PERIODS}
+        self.all = {}
+        # Корзины периодов, которые еще не прочитаны из снимка:
+        # period -> (функция, отдающая строки, изменения, сделанные до чтения)
+        self.deferred = {}
+        for date, transaction_type, category, amount, count in daily_sums:
+            self.add_amount(date, transaction_type, category, amount, count)
+
+    def add_amount(self, date, transaction_type, category, amount, count=1):
+        key = (transaction_type, category)
+        add_to(self.all, key, amount, count)
+        for period in PERIODS:
+            bucket = period_key(date, period)
+            if bucket is None:
+                continue
+            if period in self.deferred:
+                # Корзины не читаем ради одного изменения: оно применится после чтения
+                self.deferred[period][1].append((bucket, key, amount, count))
+            else:
+                add_to(self.buckets[period].setdefault(bucket, {}), key, amount, count)
+
+    def rows(self):
+        # Плоские строки (период, корзина, тип, категория, сумма в копейках, количество) для сохранения
+        for (transaction_type, category), (amount, count) in self.all.items():
+            yield ("all", "", transaction_type, category, amount, count)
+        for period in PERIODS:
+            for bucket, sums in self.period_buckets(period).items():
+                for (transaction_type, category), (amount, count) in sums.items():
+                    yield (period, bucket, transaction_type, category, amount, count)
+
+    def load_rows(self, rows):
+        for period, bucket, transaction_type, category, amount, count in rows:
+            sums = self.all if period == "all" else self.buckets[period].setdefault(bucket, {})
+            sums[(transaction_type, category)] = [amount, count]
+
+    def merge_rows(self, rows):
+        # Сложение с суммами другого файла: одинаковые корзины и категории складываются
+        for period, bucket, transaction_type, category, amount, count in rows:
+            sums = self.all if period == "all" else self.period_buckets(period).setdefault(bucket, {})
+            add_to(sums, (transaction_type, category), amount, count)
+
+    def defer(self, period, loader):
+        # Итоги за все время нужны сразу, корзины периода читаются при первом обращении к ним
+        self.deferred[period] = (loader, [])
+
+    def period_buckets(self, period):
+        deferred = self.deferred.pop(period, None)
+        if deferred is not None:
+            loader, changes = deferred
+            self.load_rows(loader())
+            buckets = self.buckets[period]
+            for bucket, key, amount, count in changes:
+                if bucket is None:
+                    # Переименование категории: вместо суммы в записи ключ новой категории
+                    for sums in buckets.values():
+                        move_key(sums, key, amount)
+                else:
+                    add_to(buckets.setdefault(bucket, {}), key, amount, count)
+        return self.buckets[period]
+
+    def add(self, transaction):
+        self.add_amount(transaction["date"], transaction["type"], transaction["category"],
+                        to_kopecks(transaction["amount"]))
+
+    def remove(self, transaction):
+        self.add_amount(transaction["date"], transaction["type"], transaction["category"],
+                        -to_kopecks(transaction["amount"]), -1)
+
+    def sums(self, period="all", date=None):
+        if period == "all":
+            return self.all
+        return self.period_buckets(period).get(period_key(date, period), {})
+
+    def totals(self, period="all", date=None):
+        # Наружу суммы отдаются в рублях, переводятся они один раз — после сложения копеек
+        totals = {"income": 0, "expense": 0}
+        for (transaction_type, category), (amount, count) in self.sums(period, date).items():
+            totals[transaction_type] += amount
+        return {transaction_type: to_rubles(amount) for transaction_type, amount in totals.items()}
+
+    def category_sums(self, transaction_type, period="all", date=None):
+        return {category: to_rubles(amount) for (kind, category), (amount, count) in self.sums(period, date).items()
+                if kind == transaction_type}
+
+    def category_counts(self, transaction_type):
+        # Число операций в каждой категории за все время
+        return {category: count for (kind, category), (amount, count) in self.all.items()
+                if kind == transaction_type}
+
+    def category_types(self, category):
+        # Типы операций, у которых есть операции в категории
+        return {kind for (kind, name) in self.all if name == category}
+
+    def rename_category(self, transaction_type, old, new):
+        # Переименование или слияние переносит суммы во всех корзинах; операции не перебираются
+        old_key, new_key = (transaction_type, old), (transaction_type, new)
+        move_key(self.all, old_key, new_key)
+        for period in PERIODS:
+            if period in self.deferred:
+                # Непрочитанные корзины переименуются после чтения, в порядке изменений
+                self.deferred[period][1].append((None, old_key, new_key, None))
+            else:
+                for sums in self.buckets[period].values():
+                    move_key(sums, old_key, new_key)
+
+    def series(self, period, date):
+        # Доходы и расходы по корзинам: объем работы зависит от числа корзин, а не операций
+        if period == "all":
+            period, keys = "year", sorted(self.period_buckets("year"))
+        else:
+            keys = bucket_keys(period, date, TREND_BUCKETS[period])
+        series = []
+        for key in keys:
+            totals = {"income": 0, "expense": 0}
+            for (transaction_type, category), (amount, count) in self.period_buckets(period).get(key, {}).items():
+                totals[transaction_type] += amount
+            series.append((key, to_rubles(totals["income"]), to_rubles(totals["expense"])))
+        return series
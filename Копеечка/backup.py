@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from storage import atomic_write_json, fsync_dir
+from transfer import FIELDS
+
+# Ключи данных, которые сохраняются в описании снимка рядом со списком кусков
+META_KEYS = ("categories", "settings", "next_id")
+
+
+def chunk_key(transaction):
+    # Кусок — это месяц: правка старой операции меняет только его
+    return transaction["date"][:7]
+
+
+def encode_chunk(transactions):
+    # Строки куска упорядочены, чтобы одинаковые данные всегда давали один и тот же хеш
+    transactions.sort(key=lambda t: (t["date"], t["id"]))
+    return "".join(json.dumps([t[field] for field in FIELDS], ensure_ascii=False) + "\n"
+                   for t in transactions).encode("utf-8")
+
+
+def decode_chunk(data):
+    return [dict(zip(FIELDS, json.loads(line))) for line in data.decode("utf-8").splitlines()]
+
+
+class BackupStore:
+    # Каталог с инкрементными копиями: куски с именем по хешу содержимого общие для всех снимков,
+    # у каждого снимка — небольшое описание со списком своих кусков
+    def __init__(self, directory):
+        self.directory = directory
+        self.chunks_dir = os.path.join(directory, "chunks")
+        self.snapshots_dir = os.path.join(directory, "snapshots")
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest + ".gz")
+
+    def create(self, data, rows, counter=None):
+        # data — категории и настройки, rows — все операции по дате (export_rows обоих хранилищ);
+        # в памяти только текущий месяц, пишутся только новые куски
+        counter = counter if counter is not None else {}
+        counter.update({"rows": 0, "chunks": 0, "written": 0, "bytes": 0})
+        chunks = []
+        month, transactions = None, []
+        for transaction in rows:
+            key = chunk_key(transaction)
+            if key != month and transactions:
+                chunks.append(self._store_chunk(month, transactions, counter))
+                transactions = []
+            month = key
+            transactions.append(transaction)
+            counter["rows"] += 1
+        if transactions:
+            chunks.append(self._store_chunk(month, transactions, counter))
+
+        created = datetime.now()
+        manifest = {
+            "created": created.isoformat(timespec="seconds"),
+            "rows": counter["rows"],
+            "meta": {key: data[key] for key in META_KEYS if key in data},
+            "chunks": chunks
+        }
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        name = created.strftime("%Y%m%d-%H%M%S-%f")
+        # Описание пишется последним: снимок без него не виден, а лишние куски безвредны
+        atomic_write_json(os.path.join(self.snapshots_dir, name + ".json"), manifest)
+        return name
+
+    def _store_chunk(self, month, transactions, counter):
+        # Даты не в ISO-формате могут дать один ключ несколько раз: это просто несколько кусков
+        content = encode_chunk(transactions)
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.chunk_path(digest)
+        if not os.path.exists(path):
+            self._write_chunk(path, content)
+            counter["written"] += 1
+            counter["bytes"] += os.path.getsize(path)
+        counter["chunks"] += 1
+        return {"key": month, "hash": digest, "rows": len(transactions)}
+
+    def _write_chunk(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(content))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        fsync_dir(path)
+
+    def snapshots(self):
+        # Имена снимков от старых к новым вместе с их описаниями
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        result = []
+        for file_name in sorted(os.listdir(self.snapshots_dir)):
+            if file_name.endswith(".json"):
+                result.append((file_name[:-len(".json")], self.manifest(file_name[:-len(".json")])))
+        return result
+
+    def manifest(self, name):
+        with open(os.path.join(self.snapshots_dir, name + ".json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read_chunk(self, chunk):
+        with open(self.chunk_path(chunk["hash"]), "rb") as f:
+            content = gzip.decompress(f.read())
+        # Хеш проверяется по распакованному содержимому: он же имя файла куска
+        if hashlib.sha256(content).hexdigest() != chunk["hash"]:
+            raise ValueError(f"Кусок {chunk['key']} поврежден: хеш не совпадает")
+        transactions = decode_chunk(content)
+        if len(transactions) != chunk["rows"]:
+            raise ValueError(f"Кусок {chunk['key']} поврежден: не совпадает число операций")
+        return transactions
+
+    def restore(self, name):
+        # Данные в формате Ledger.replace: описание снимка + операции всех его кусков
+        manifest = self.manifest(name)
+        data = dict(manifest["meta"])
+        data["transactions"] = []
+        for chunk in manifest["chunks"]:
+            data["transactions"].extend(self.read_chunk(chunk))
+        return data
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date as Date, timedelta
+
+from aggregates import PERIODS
+from ledger import Ledger
+from storage import BINARY_EXTENSIONS, migrate_json_to_binary, migrate_json_to_sqlite
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля нет, пиковая память тогда не сообщается
+    resource = None
+
+DEFAULT_SIZES = "10k,100k"
+# Расширение файла данных для каждого хранилища
+BACKEND_EXTENSIONS = {"json": ".json", "sqlite": ".db", "binary": BINARY_EXTENSIONS[0]}
+# Высота окна таблицы в строках: столько словарей собирает отрисовка после фильтра
+TREE_WINDOW = 40
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith("k"):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith("m"):
+        multiplier, value = 1000000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def category_names(transaction_type, cardinality):
+    prefix = "Доход" if transaction_type == "income" else "Расход"
+    return [f"{prefix} {number}" for number in range(1, cardinality + 1)]
+
+
+def generate_transactions(count, categories=20, days=3650, start="2016-01-01", seed=0):
+    # Один и тот же seed всегда дает один и тот же журнал
+    rng = random.Random(seed)
+    first_day = Date.fromisoformat(start)
+    names = {t: category_names(t, categories) for t in ("income", "expense")}
+    for transaction_id in range(1, count + 1):
+        # Расходов примерно вчетверо больше, чем доходов
+        transaction_type = "income" if rng.random() < 0.2 else "expense"
+        yield {
+            "id": transaction_id,
+            "date": (first_day + timedelta(days=rng.randrange(days))).isoformat(),
+            "type": transaction_type,
+            "category": rng.choice(names[transaction_type]),
+            "amount": round(rng.lognormvariate(6.5, 1.2), 2),
+            "description": f"Операция {rng.randrange(1000)}"
+        }
+
+
+def write_ledger(path, count, categories=20, days=3650, start="2016-01-01", seed=0):
+    # Снимок пишется потоком, чтобы генерация 10 млн операций не держала их в памяти
+    json_path = os.path.splitext(path)[0] + ".json"
+    header = {
+        "categories": {t: category_names(t, categories) for t in ("income", "expense")},
+        "settings": {"theme": "light"},
+        "journal_seq": 0
+    }
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "transactions": [')
+        for number, transaction in enumerate(generate_transactions(count, categories, days, start, seed)):
+            if number:
+                f.write(", ")
+            f.write(json.dumps(transaction, ensure_ascii=False))
+        f.write("]}")
+
+    if path != json_path:
+        migrate = migrate_json_to_binary if path.endswith(BINARY_EXTENSIONS) else migrate_json_to_sqlite
+        migrate(json_path, path)
+        os.remove(json_path)
+    else:
+        # Потоком пишется снимок старого формата; первая загрузка переписывает его в текущий
+        # (колонки, суммы по периодам), и эта запись не должна попасть в замер загрузки
+        ledger = Ledger(path)
+        ledger.load()
+        ledger.close()
+    return path
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples) * 1000,
+        "total_ms": sum(samples) * 1000
+    }
+
+
+def measure(operation, arguments):
+    samples = []
+    for argument in arguments:
+        started = time.perf_counter()
+        operation(argument)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, Linux — килобайты
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def random_date(rng, start, days):
+    return (Date.fromisoformat(start) + timedelta(days=rng.randrange(days))).isoformat()
+
+
+def run_size(size, args, workdir):
+    path = os.path.join(workdir, f"bench_{size}{BACKEND_EXTENSIONS[args.backend]}")
+    started = time.perf_counter()
+    write_ledger(path, size, args.categories, args.days, args.start, args.seed)
+    result = {"size": size, "generate_ms": (time.perf_counter() - started) * 1000,
+              "file_bytes": os.path.getsize(path), "operations": {}}
+    operations = result["operations"]
+    rng = random.Random(args.seed + 1)
+    names = {t: category_names(t, args.categories) for t in ("income", "expense")}
+
+    # Загрузка: каждый раз новый объект, как при запуске приложения
+    def load(_):
+        ledger = Ledger(path)
+        ledger.load()
+        ledger.close()
+    operations["load"] = measure(load, range(args.load_repeat))
+
+    ledger = Ledger(path)
+    ledger.load()
+    try:
+        def add(_):
+            ledger.add(random_date(rng, args.start, args.days), "expense", rng.choice(names["expense"]),
+                       round(rng.uniform(1, 5000), 2), "Бенчмарк")
+        operations["add"] = measure(add, range(args.repeat))
+
+        operations["delete"] = measure(ledger.delete, rng.sample(range(1, size + 1), min(args.repeat, size)))
+
+        def query(_):
+            transaction_type = rng.choice((None, "income", "expense"))
+            category = rng.choice(names[transaction_type]) if transaction_type and rng.random() < 0.5 else None
+            date_from = random_date(rng, args.start, args.days)
+            date_to = (Date.fromisoformat(date_from) + timedelta(days=rng.randrange(1, 366))).isoformat()
+            rows = ledger.query(transaction_type, category, date_from, date_to)
+            # Как отрисовка таблицы: длина выборки и первое окно строк
+            len(rows)
+            rows[:TREE_WINDOW]
+        operations["filter"] = measure(query, range(args.repeat))
+
+        operations["filter_all"] = measure(lambda _: len(ledger.query()), range(args.load_repeat))
+
+        def aggregate(_):
+            period = rng.choice(("all",) + PERIODS)
+            day = random_date(rng, args.start, args.days)
+            ledger.totals(period, day)
+            ledger.category_sums("income", period, day)
+            ledger.category_sums("expense", period, day)
+        operations["aggregate"] = measure(aggregate, range(args.repeat))
+
+        operations["aggregate_rebuild"] = measure(lambda _: ledger.load_aggregates(), range(args.load_repeat))
+
+        # Полная перезапись файла данных, как при восстановлении из копии
+        if hasattr(ledger.storage, "save"):
+            operations["save"] = measure(lambda _: ledger.storage.save(), range(args.load_repeat))
+        else:
+            data = ledger.export()
+            operations["save"] = measure(lambda _: ledger.replace(data), range(args.load_repeat))
+    finally:
+        ledger.close()
+
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Замеры скорости операций на синтетических данных")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="размеры через запятую, например 10k,100k,1M,10M")
+    parser.add_argument("--backend", choices=tuple(BACKEND_EXTENSIONS), default="json")
+    parser.add_argument("--categories", type=int, default=20, help="число категорий каждого типа")
+    parser.add_argument("--days", type=int, default=3650, help="сколько дней покрывают операции")
+    parser.add_argument("--start", default="2016-01-01", help="дата первого дня")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=200, help="повторов для быстрых операций")
+    parser.add_argument("--load-repeat", type=int, default=5, help="повторов для загрузки и полной записи")
+    parser.add_argument("--output", help="файл для JSON-отчета, по умолчанию stdout")
+    parser.add_argument("--workdir", help="каталог для файлов данных, по умолчанию временный")
+    parser.add_argument("--in-process", action="store_true",
+                        help="не запускать отдельный процесс на каждый размер (пиковая память общая)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="kopeechka-bench-")
+    try:
+        results = []
+        for size in sizes:
+            if args.in_process or len(sizes) == 1:
+                results.append(run_size(size, args, workdir))
+                continue
+            # Отдельный процесс, чтобы пиковая память относилась к одному размеру
+            command = [sys.executable, os.path.abspath(__file__), "--sizes", str(size), "--workdir", workdir]
+            for option in ("backend", "categories", "days", "start", "seed", "repeat", "load_repeat"):
+                command += ["--" + option.replace("_", "-"), str(getattr(args, option))]
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+            results.extend(json.loads(output)["results"])
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "categories": args.categories,
+        "days": args.days,
+        "seed": args.seed,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=4)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import base64
+import io
+import queue
+import threading
+import tkinter as tk
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from perf import timed
+
+# Пауза, за которую несколько изменений подряд сливаются в одну перерисовку
+DEBOUNCE_MS = 150
+# Как часто главный поток забирает готовые картинки
+POLL_MS = 30
+
+
+class ChartRenderer:
+    def __init__(self, root, label, dpi=100):
+        self.root = root
+        self.label = label
+        self.dpi = dpi
+        # Рисуем в Agg без Tk, поэтому фигуру можно строить в рабочем потоке
+        self.figure = Figure(figsize=(8, 6), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.image = None
+        self.generation = 0
+        self._data = ({}, {}, [])
+        self._size = None
+        self._pending = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._results = queue.Queue()
+        self.label.bind("<Configure>", self._on_resize)
+
+    def request(self, income_data, expense_data, series=()):
+        self._data = (income_data, expense_data, list(series))
+        self.redraw()
+
+    def redraw(self):
+        # Новая версия данных сразу делает устаревшими все начатые отрисовки
+        self.generation += 1
+        if self._pending is not None:
+            self.root.after_cancel(self._pending)
+        self._pending = self.root.after(DEBOUNCE_MS, self._start)
+
+    def _on_resize(self, event):
+        if self._size is not None and abs(event.width - self._size[0]) < 2 and abs(event.height - self._size[1]) < 2:
+            return
+        self.redraw()
+
+    def _start(self):
+        self._pending = None
+        width = self.label.winfo_width()
+        height = self.label.winfo_height()
+        if width < 50 or height < 50:
+            width, height = 800, 600
+        self._size = (width, height)
+
+        self._in_flight += 1
+        if self._in_flight == 1:
+            self.root.after(POLL_MS, self._poll)
+        threading.Thread(target=self._render, args=(self.generation, width, height) + self._data,
+                         daemon=True).start()
+
+    @timed("render_chart")
+    def _render(self, generation, width, height, income_data, expense_data, series):
+        image_data = None
+        try:
+            with self._lock:
+                # Отрисовка, которую уже обогнали новые данные, не начинается
+                if generation != self.generation:
+                    return
+                self.figure.set_size_inches(width / self.dpi, height / self.dpi)
+                self.figure.clear()
+
+                # Круговые диаграммы сверху, динамика по периодам снизу
+                rows = 2 if series else 1
+
+                # График доходов по категориям
+                if income_data:
+                    ax1 = self.figure.add_subplot(rows, 2, 1)
+                    ax1.pie(income_data.values(), labels=income_data.keys(), autopct="%1.1f%%")
+                    ax1.set_title("Доходы по категориям")
+
+                # График расходов по категориям
+                if expense_data:
+                    ax2 = self.figure.add_subplot(rows, 2, 2)
+                    ax2.pie(expense_data.values(), labels=expense_data.keys(), autopct="%1.1f%%")
+                    ax2.set_title("Расходы по категориям")
+
+                if series:
+                    self._draw_series(self.figure.add_subplot(rows, 1, 2), series)
+
+                if generation != self.generation:
+                    return
+                buffer = io.BytesIO()
+                self.canvas.print_png(buffer)
+                image_data = base64.b64encode(buffer.getvalue())
+        finally:
+            self._results.put((generation, image_data))
+
+    def _draw_series(self, ax, series):
+        # Доходы вверх, расходы вниз, линия — баланс корзины
+        keys = [key for key, income, expense in series]
+        positions = range(len(series))
+        ax.bar(positions, [income for key, income, expense in series], color="#4caf50", label="Доходы")
+        ax.bar(positions, [-expense for key, income, expense in series], color="#e57373", label="Расходы")
+        ax.plot(positions, [income - expense for key, income, expense in series], color="#1565c0",
+                marker=".", label="Баланс")
+        ax.axhline(0, color="#888888", linewidth=0.8)
+
+        # Подписываем не больше 12 корзин, иначе подписи наезжают друг на друга
+        step = max(1, len(keys) // 12)
+        ax.set_xticks(positions[::step])
+        ax.set_xticklabels(keys[::step], rotation=30, ha="right", fontsize=8)
+        ax.set_title("Динамика доходов и расходов")
+        ax.legend(loc="upper left", fontsize=8)
+
+    def _poll(self):
+        latest = None
+        while True:
+            try:
+                generation, image_data = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._in_flight -= 1
+            if generation == self.generation and image_data is not None:
+                latest = image_data
+
+        if latest is not None:
+            self.image = tk.PhotoImage(data=latest, format="png")
+            self.label.configure(image=self.image)
+        if self._in_flight > 0:
+            self.root.after(POLL_MS, self._poll)
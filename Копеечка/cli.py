@@ -0,0 +1,276 @@
+import argparse
+import csv
+import json
+import sys
+
+from aggregates import PERIODS
+from backup import BackupStore
+from consolidate import consolidate
+from ledger import Ledger, today
+from perf import metrics
+from storage import LOAD_ERRORS
+from transfer import FIELDS
+
+
+def command_add(ledger, args):
+    transaction = ledger.add(args.date, args.type, args.category, args.amount, args.description)
+    print(f"Операция {transaction['id']} добавлена")
+
+
+def command_delete(ledger, args):
+    missing = [transaction_id for transaction_id in args.ids if not ledger.get(transaction_id)]
+    if missing:
+        raise ValueError(f"Операции не найдены: {', '.join(map(str, missing))}")
+    removed = ledger.delete_many(args.ids)
+    print(f"Удалено операций: {len(removed)}")
+
+
+def command_edit(ledger, args):
+    updated = ledger.update_many(args.ids, type=args.type, category=args.category, date=args.date,
+                                 amount=args.amount, description=args.description)
+    print(f"Изменено операций: {len(updated)}")
+
+
+def command_list(ledger, args):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(FIELDS)
+    for transaction in ledger.query(args.type, args.category, args.date_from, args.date_to, args.search):
+        writer.writerow([transaction[field] for field in FIELDS])
+
+
+def command_report(ledger, args):
+    print_report(build_report(ledger, args.period, args.date), args)
+
+
+def command_consolidate(args):
+    counter = {}
+    aggregates = consolidate(args.files, args.workers, counter)
+    for path, error in counter["errors"].items():
+        print(f"Ошибка: {path}: {error}", file=sys.stderr)
+    # У сводки нет своего файла данных, поэтому день периода по умолчанию подставляем сами
+    report = build_report(aggregates, args.period, args.date or today())
+    report["ledgers"] = counter["ledgers"]
+    if not args.json:
+        print(f"Файлов в сводке: {counter['ledgers']}")
+    print_report(report, args)
+    return 1 if counter["errors"] else 0
+
+
+def build_report(source, period, date):
+    # source — Ledger или Aggregates сводки: у них одинаковые totals, category_sums и series
+    totals = source.totals(period, date)
+    return {
+        "period": period,
+        "income": totals["income"],
+        "expense": totals["expense"],
+        "balance": totals["income"] - totals["expense"],
+        "categories": {
+            "income": source.category_sums("income", period, date),
+            "expense": source.category_sums("expense", period, date)
+        },
+        "series": [{"bucket": key, "income": income, "expense": expense}
+                   for key, income, expense in source.series(period, date)]
+    }
+
+
+def print_report(report, args):
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=4)
+        print()
+        return
+
+    print(f"Доходы: {report['income']:.2f} руб.")
+    print(f"Расходы: {report['expense']:.2f} руб.")
+    print(f"Баланс: {report['balance']:.2f} руб.")
+    for transaction_type, title in (("income", "Доходы по категориям"), ("expense", "Расходы по категориям")):
+        sums = report["categories"][transaction_type]
+        if sums:
+            print(f"\n{title}:")
+            for category, amount in sorted(sums.items(), key=lambda item: -item[1]):
+                print(f"  {category}: {amount:.2f} руб.")
+    if args.trend:
+        print("\nДинамика:")
+        for entry in report["series"]:
+            print(f"  {entry['bucket']}: +{entry['income']:.2f} / -{entry['expense']:.2f}")
+
+
+def command_categories(ledger, args):
+    for transaction_type in ("income", "expense"):
+        counts = ledger.category_counts(transaction_type)
+        print("Доходы:" if transaction_type == "income" else "Расходы:")
+        for category in ledger.data["categories"][transaction_type]:
+            print(f"  {category}: {counts.get(category, 0)}")
+
+
+def command_rename_category(ledger, args):
+    moved = ledger.rename_category(args.type, args.old, args.new, merge=args.merge)
+    print(f"Категория переименована, операций перенесено: {moved}")
+
+
+def command_backup(ledger, args):
+    counter = {}
+    name = ledger.backup(args.dir, counter)
+    print(f"Снимок {name}: операций {counter['rows']}, кусков {counter['chunks']}, "
+          f"новых {counter['written']} ({counter['bytes']} байт)")
+
+
+def command_backups(ledger, args):
+    for name, manifest in BackupStore(args.dir or ledger.backup_dir()).snapshots():
+        print(f"{name}  {manifest['created']}  операций: {manifest['rows']}")
+
+
+def command_restore(ledger, args):
+    print(f"Восстановлен снимок {ledger.restore_backup(args.dir, args.name)}")
+
+
+def command_import(ledger, args):
+    for path in args.files:
+        counter = ledger.import_file(path)
+        print(f"{path}: добавлено {counter['added']}, дубликатов {counter['duplicates']}, "
+              f"ошибок {counter['errors']}")
+
+
+def command_export(ledger, args):
+    counter = ledger.export_file(args.path)
+    print(f"Выгружено операций: {counter['rows']}")
+
+
+def command_migrate(ledger, args):
+    if args.format == "binary":
+        print(f"Данные перенесены в {ledger.migrate_to_binary()}")
+    else:
+        print(f"Данные перенесены в {ledger.migrate_to_sqlite()}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="kopeechka", description="Учет доходов и расходов без окна")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="записать замеры, профиль cProfile и память tracemalloc в JSON-файл")
+    parser.add_argument("-f", "--file", help="файл данных (по умолчанию finance_data.db, finance_data.kopb "
+                                             "или finance_data.json)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="добавить операцию")
+    add.add_argument("date", help="дата ГГГГ-ММ-ДД")
+    add.add_argument("type", choices=("income", "expense"))
+    add.add_argument("category")
+    add.add_argument("amount", type=float)
+    add.add_argument("description", nargs="?", default="")
+    add.set_defaults(handler=command_add)
+
+    delete = commands.add_parser("delete", help="удалить операции по id")
+    delete.add_argument("ids", type=int, nargs="+")
+    delete.set_defaults(handler=command_delete)
+
+    edit = commands.add_parser("edit", help="изменить операции по id одной пачкой")
+    edit.add_argument("ids", type=int, nargs="+")
+    edit.add_argument("--type", choices=("income", "expense"))
+    edit.add_argument("--category")
+    edit.add_argument("--date")
+    edit.add_argument("--amount", type=float)
+    edit.add_argument("--description")
+    edit.set_defaults(handler=command_edit)
+
+    listing = commands.add_parser("list", help="вывести операции в CSV")
+    listing.add_argument("--type", choices=("income", "expense"))
+    listing.add_argument("--category")
+    listing.add_argument("--from", dest="date_from")
+    listing.add_argument("--to", dest="date_to")
+    listing.add_argument("--search", help="слова из описания или категории, можно начала слов")
+    listing.set_defaults(handler=command_list)
+
+    report = commands.add_parser("report", help="итоги за период")
+    report.add_argument("--period", choices=("all",) + PERIODS, default="all")
+    report.add_argument("--date", help="день внутри периода, по умолчанию сегодня")
+    report.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    report.add_argument("--trend", action="store_true", help="показать доходы и расходы по корзинам периода")
+    report.set_defaults(handler=command_report)
+
+    consolidated = commands.add_parser("consolidate", help="сводный отчет по нескольким файлам данных")
+    consolidated.add_argument("files", nargs="+", help="файлы данных в любом формате")
+    consolidated.add_argument("--workers", type=int, help="число процессов (по умолчанию по числу ядер)")
+    consolidated.add_argument("--period", choices=("all",) + PERIODS, default="all")
+    consolidated.add_argument("--date", help="день внутри периода, по умолчанию сегодня")
+    consolidated.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    consolidated.add_argument("--trend", action="store_true", help="показать доходы и расходы по корзинам периода")
+    consolidated.set_defaults(handler=command_consolidate)
+
+    categories = commands.add_parser("categories", help="категории и число операций в них")
+    categories.set_defaults(handler=command_categories)
+
+    rename = commands.add_parser("rename-category", help="переименовать категорию вместе с ее операциями")
+    rename.add_argument("type", choices=("income", "expense"))
+    rename.add_argument("old")
+    rename.add_argument("new")
+    rename.add_argument("--merge", action="store_true", help="слить с уже существующей категорией")
+    rename.set_defaults(handler=command_rename_category)
+
+    backup = commands.add_parser("backup", help="инкрементная резервная копия")
+    backup.add_argument("--dir", help="каталог копий (по умолчанию рядом с файлом данных)")
+    backup.set_defaults(handler=command_backup)
+
+    backups = commands.add_parser("backups", help="список резервных копий")
+    backups.add_argument("--dir", help="каталог копий (по умолчанию рядом с файлом данных)")
+    backups.set_defaults(handler=command_backups)
+
+    restore = commands.add_parser("restore", help="восстановить данные из резервной копии")
+    restore.add_argument("name", nargs="?", help="имя снимка (по умолчанию последний)")
+    restore.add_argument("--dir", help="каталог копий (по умолчанию рядом с файлом данных)")
+    restore.set_defaults(handler=command_restore)
+
+    imports = commands.add_parser("import", help="загрузить операции из CSV/JSONL/JSON")
+    imports.add_argument("files", nargs="+")
+    imports.set_defaults(handler=command_import)
+
+    export = commands.add_parser("export", help="выгрузить операции в CSV/JSONL")
+    export.add_argument("path")
+    export.set_defaults(handler=command_export)
+
+    migrate = commands.add_parser("migrate", help="перенести данные в SQLite или двоичный снимок")
+    migrate.add_argument("--format", choices=("sqlite", "binary"), default="sqlite")
+    migrate.set_defaults(handler=command_migrate)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        metrics.enabled = True
+        metrics.start_capture()
+    try:
+        return run(args)
+    finally:
+        if args.profile:
+            metrics.stop_capture()
+            metrics.dump(args.profile)
+
+
+def run(args):
+    if args.handler is command_consolidate:
+        # Сводка читает только перечисленные файлы, текущий файл данных ей не нужен
+        try:
+            return args.handler(args)
+        except (ValueError, OSError) as e:
+            print(f"Ошибка: {e}", file=sys.stderr)
+            return 1
+
+    ledger = Ledger(args.file)
+    try:
+        ledger.load()
+    except LOAD_ERRORS as e:
+        ledger.close()
+        print(f"Ошибка: файл данных поврежден: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        args.handler(ledger, args)
+    except (ValueError, OSError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    finally:
+        ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date as Date
+from itertools import compress
+
+from money import to_kopecks, to_rubles
+
+
+def to_day(date):
+    return Date.fromisoformat(date).toordinal()
+
+
+def from_day(day):
+    return Date.fromordinal(day).isoformat()
+
+
+def mask_equal(column, value):
+    # Маска строк, где значение колонки равно value: сравнение идет в C, без цикла Python
+    return bytes(map(value.__eq__, column))
+
+
+def mask_and(*masks):
+    # Побитовое И масок через длинные целые — одна операция на всю колонку
+    size = len(masks[0])
+    result = int.from_bytes(masks[0], "little")
+    for mask in masks[1:]:
+        result &= int.from_bytes(mask, "little")
+    return result.to_bytes(size, "little")
+
+
+def mask_or(*masks):
+    size = len(masks[0])
+    result = 0
+    for mask in masks:
+        result |= int.from_bytes(mask, "little")
+    return result.to_bytes(size, "little")
+
+
+def mask_in(column, codes):
+    # Маска строк, где код колонки входит в набор; один код сравнивается без множества
+    if len(codes) == 1:
+        return mask_equal(column, next(iter(codes)))
+    return bytes(map(codes.__contains__, column))
+
+
+class StringPool:
+    # Каждая строка хранится один раз, в колонках лежат только ее коды
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        # Растет при переименовании: индексы по пулу, которые рассчитывают только на дописывание, перестраиваются
+        self.generation = 0
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def codes_of(self, value):
+        # После слияния у одной строки может быть несколько кодов
+        return {code for code, item in enumerate(self.values) if item == value}
+
+    def rename(self, old, new):
+        # Все коды строки old получают значение new; колонки с этими кодами не меняются
+        codes = self.codes_of(old)
+        for code in codes:
+            self.values[code] = new
+        if codes:
+            self.codes.pop(old, None)
+            self.codes.setdefault(new, min(codes))
+            self.generation += 1
+        return codes
+
+
+class ColumnStore:
+    def __init__(self, transactions=()):
+        # Параллельные типизированные колонки; удаленные строки только помечаются.
+        # Суммы хранятся в целых копейках: их сложение точное при любом числе строк
+        self.ids = array("q")
+        self.days = array("i")
+        self.types = array("B")
+        self.categories = array("I")
+        self.amounts = array("q")
+        self.descriptions = array("I")
+        self.alive = bytearray()
+        self.type_pool = StringPool()
+        self.category_pool = StringPool()
+        self.description_pool = StringPool()
+        # Даты, которые не разбираются как ISO, хранятся как есть
+        self.raw_dates = {}
+        # Id может повторяться, поэтому по id храним список позиций
+        self._by_id = {}
+        self.count = 0
+
+        for transaction in transactions:
+            self.append(transaction)
+
+    def append(self, transaction):
+        position = len(self.ids)
+        try:
+            day = to_day(transaction["date"])
+        except ValueError:
+            day = 0
+            self.raw_dates[position] = transaction["date"]
+
+        self.ids.append(transaction["id"])
+        self.days.append(day)
+        self.types.append(self.type_pool.code(transaction["type"]))
+        self.categories.append(self.category_pool.code(transaction["category"]))
+        self.amounts.append(to_kopecks(transaction["amount"]))
+        self.descriptions.append(self.description_pool.code(transaction.get("description", "")))
+        self.alive.append(1)
+        if self._by_id is not None:
+            self._by_id.setdefault(transaction["id"], []).append(position)
+        self.count += 1
+        return position
+
+    def to_columns(self):
+        # Колонки для снимка в JSON: списки чисел разбираются и собираются в массивы намного быстрее,
+        # чем словари операций. Удаленные строки в снимок не попадают
+        alive = self.alive
+        columns = {name: list(compress(getattr(self, name), alive))
+                   for name in ("ids", "days", "types", "categories", "amounts", "descriptions")}
+        columns["raw_dates"] = {alive[:position].count(1): date for position, date in self.raw_dates.items()
+                                if alive[position]}
+        for name in ("type_pool", "category_pool", "description_pool"):
+            columns[name] = list(getattr(self, name).values)
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        # Обратная сборка: массивы заполняются целиком, без разбора дат и поиска строк в пулах по одной.
+        # Снимок пишется уже с уникальными id, поэтому словарь по id можно отложить
+        store = cls()
+        for name, typecode in (("ids", "q"), ("days", "i"), ("types", "B"), ("categories", "I"),
+                               ("amounts", "q"), ("descriptions", "I")):
+            setattr(store, name, array(typecode, columns[name]))
+        store.count = len(store.ids)
+        store.alive = bytearray(b"\x01") * store.count
+        store.raw_dates = {int(position): date for position, date in columns["raw_dates"].items()}
+        for name in ("type_pool", "category_pool", "description_pool"):
+            pool = getattr(store, name)
+            pool.values = columns[name]
+            pool.codes = {value: code for code, value in enumerate(pool.values)}
+        store.unindex_ids()
+        return store
+
+    @property
+    def by_id(self):
+        if self._by_id is None:
+            by_id = {}
+            for position in self.positions():
+                by_id.setdefault(self.ids[position], []).append(position)
+            self._by_id = by_id
+        return self._by_id
+
+    def unindex_ids(self):
+        # Словарь по id для миллионов строк строится дольше, чем загружаются колонки,
+        # поэтому его можно отложить до первого обращения
+        self._by_id = None
+
+    def delete(self, transaction_id):
+        positions = self.by_id.pop(transaction_id, [])
+        for position in positions:
+            self.alive[position] = 0
+        self.count -= len(positions)
+        return positions
+
+    def renumber(self, position, transaction_id):
+        positions = self.by_id[self.ids[position]]
+        positions.remove(position)
+        if not positions:
+            del self.by_id[self.ids[position]]
+        self.ids[position] = transaction_id
+        self.by_id.setdefault(transaction_id, []).append(position)
+
+    def duplicate_positions(self):
+        # Старые версии выдавали id по числу операций, и после удалений id повторялись.
+        # Отложенный словарь бывает только у двоичного снимка, а его id уже уникальны
+        if self._by_id is None:
+            return []
+        return [position for positions in self.by_id.values() for position in positions[1:]]
+
+    def date(self, position):
+        day = self.days[position]
+        return from_day(day) if day else self.raw_dates[position]
+
+    def row(self, position):
+        return {
+            "id": self.ids[position],
+            "date": self.date(position),
+            "type": self.type_pool.values[self.types[position]],
+            "category": self.category_pool.values[self.categories[position]],
+            "amount": to_rubles(self.amounts[position]),
+            "description": self.description_pool.values[self.descriptions[position]]
+        }
+
+    def positions(self):
+        return compress(range(len(self.alive)), self.alive)
+
+    def rows(self):
+        return [self.row(position) for position in self.positions()]
+
+    def copy(self):
+        # Копия колонок для чтения из другого потока; пулы строк только дополняются
+        store = ColumnStore()
+        for name in ("ids", "days", "types", "categories", "amounts", "descriptions", "alive"):
+            setattr(store, name, getattr(self, name)[:])
+        store.type_pool = self.type_pool
+        # Пул категорий меняется при переименовании, поэтому копируется (он маленький);
+        # остальные пулы только дополняются
+        store.category_pool = StringPool()
+        store.category_pool.values = list(self.category_pool.values)
+        store.category_pool.codes = dict(self.category_pool.codes)
+        store.description_pool = self.description_pool
+        store.raw_dates = dict(self.raw_dates)
+        store.count = self.count
+        return store
+
+    def type_mask(self, transaction_type):
+        code = self.type_pool.codes.get(transaction_type)
+        if code is None:
+            return bytes(len(self.alive))
+        # Колонка типов однобайтовая, поэтому маску дает таблица перекодировки
+        table = bytes(int(value == code) for value in range(256))
+        return bytes(self.types).translate(table)
+
+    def category_mask(self, category):
+        codes = self.category_pool.codes_of(category)
+        if not codes:
+            return bytes(len(self.alive))
+        return mask_in(self.categories, codes)
+
+    def rename_category(self, transaction_type, old, new, exclusive=False):
+        if exclusive:
+            # Категорией пользуются только операции этого типа: меняется строка в пуле,
+            # а строки операций не перебираются
+            self.category_pool.rename(old, new)
+            return
+        # То же имя есть у операций другого типа: у строк этого типа меняется код в колонке
+        mask = mask_and(self.alive, self.type_mask(transaction_type), self.category_mask(old))
+        code = self.category_pool.code(new)
+        for position in compress(range(len(mask)), mask):
+            self.categories[position] = code
+
+    def daily_sums(self):
+        # Суммы по дням в копейках — из них строятся суммы по периодам
+        alive = self.alive
+        keys = zip(compress(self.days, alive), compress(self.types, alive), compress(self.categories, alive))
+        sums = {}
+        for key, amount in zip(keys, compress(self.amounts, alive)):
+            entry = sums.get(key)
+            if entry is None:
+                sums[key] = [amount, 1]
+            else:
+                entry[0] += amount
+                entry[1] += 1
+
+        types = self.type_pool.values
+        categories = self.category_pool.values
+        result = [(from_day(day), types[type_code], categories[category_code], amount, count)
+                  for (day, type_code, category_code), (amount, count) in sums.items() if day]
+        for position, date in self.raw_dates.items():
+            if alive[position]:
+                result.append((date, types[self.types[position]], categories[self.categories[position]],
+                               self.amounts[position], 1))
+        return result
+
+
+class Rows:
+    # Ленивая выборка: хранит позиции строк, а словари собирает только по запросу
+    def __init__(self, store, positions):
+        self.store = store
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.store.row(position) for position in self.positions[item]]
+        return self.store.row(self.positions[item])
+
+    def __delitem__(self, item):
+        del self.positions[item]
+
+    def __iter__(self):
+        return (self.store.row(position) for position in self.positions)
+
+    def insert(self, index, transaction):
+        self.positions.insert(index, self.store.by_id[transaction["id"]][-1])
+
+    def ids(self):
+        return map(self.store.ids.__getitem__, self.positions)
+
+    def find(self, transaction):
+        # Позиции отсортированы по дню, поэтому ищем только среди операций того же дня
+        try:
+            day = to_day(transaction["date"])
+        except ValueError:
+            day = 0
+        start = bisect_left(self.positions, day, key=self.store.days.__getitem__)
+        end = bisect_right(self.positions, day, lo=start, key=self.store.days.__getitem__)
+        for index in range(start, end):
+            if self.store.ids[self.positions[index]] == transaction["id"]:
+                return index
+        return None
@@ -0,0 +1,43 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from aggregates import Aggregates
+from ledger import Ledger
+from storage import LOAD_ERRORS
+
+
+def ledger_rows(data_file):
+    # Выполняется в процессе пула: файл читается там целиком, а в родителя уходят
+    # только суммы по периодам, поэтому память родителя не зависит от числа операций
+    if not os.path.exists(data_file):
+        # Ledger создал бы на месте опечатки пустой файл данных
+        raise FileNotFoundError(f"Файл не найден: {data_file}")
+    ledger = Ledger(data_file)
+    try:
+        ledger.load()
+        return ledger.rollup_rows()
+    finally:
+        ledger.close()
+
+
+def consolidate(data_files, workers=None, counter=None):
+    # Сводка по многим файлам данных: каждый файл считается в отдельном процессе,
+    # родитель складывает готовые суммы по мере их поступления
+    counter = counter if counter is not None else {}
+    counter["ledgers"] = 0
+    counter["errors"] = {}
+    aggregates = Aggregates()
+    # Один и тот же файл дважды и посчитался бы дважды, и открылся бы двумя процессами сразу
+    data_files = list(dict.fromkeys(os.path.abspath(data_file) for data_file in data_files))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ledger_rows, data_file): data_file for data_file in data_files}
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except LOAD_ERRORS as e:
+                # Поврежденный или недоступный файл не останавливает сводку по остальным
+                counter["errors"][futures[future]] = str(e)
+                continue
+            aggregates.merge_rows(rows)
+            counter["ledgers"] += 1
+    return aggregates
@@ -0,0 +1,91 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+
+from columns import mask_and, to_day
+from search import TextSearch, matches_text
+
+# С какого размера пачки дешевле слить списки, чем вставлять по одной
+MERGE_THRESHOLD = 64
+
+
+def matches_filters(transaction, transaction_type=None, category=None, date_from=None, date_to=None, text=None):
+    # Даты хранятся в ISO-формате, поэтому их можно сравнивать как строки
+    if transaction_type and transaction["type"] != transaction_type:
+        return False
+    if category and transaction["category"] != category:
+        return False
+    if date_from and transaction["date"] < date_from:
+        return False
+    if date_to and transaction["date"] > date_to:
+        return False
+    if text and not matches_text(transaction, text):
+        return False
+    return True
+
+
+class TransactionIndex:
+    def __init__(self, store):
+        # Позиции строк хранилища, отсортированные по дате, и параллельный массив дней
+        self.store = store
+        positions = sorted(store.positions(), key=store.days.__getitem__)
+        self.positions = array("q", positions)
+        self.days = array("i", map(store.days.__getitem__, positions))
+        # Удаленные позиции остаются в массивах до чистки и отсеиваются маской живых строк
+        self.dead = 0
+        self.search = TextSearch(store)
+
+    def add(self, position):
+        day = self.store.days[position]
+        index = bisect_right(self.days, day)
+        self.days.insert(index, day)
+        self.positions.insert(index, position)
+
+    def add_many(self, positions):
+        if len(positions) < MERGE_THRESHOLD:
+            for position in positions:
+                self.add(position)
+            return
+
+        # Два отсортированных куска timsort сливает за линейное время;
+        # сортировка устойчива, поэтому новые операции встают после старых той же даты
+        merged = list(self.positions)
+        merged.extend(sorted(positions, key=self.store.days.__getitem__))
+        merged.sort(key=self.store.days.__getitem__)
+        self.positions = array("q", merged)
+        self.days = array("i", map(self.store.days.__getitem__, merged))
+
+    def remove(self, position):
+        # Хранилище уже пометило строку удаленной, поэтому массивы не сдвигаем;
+        # их чистим, только когда мертвых позиций становится больше половины
+        self.dead += 1
+        if self.dead * 2 > len(self.positions):
+            self.purge()
+
+    def purge(self):
+        keep = bytes(map(self.store.alive.__getitem__, self.positions))
+        self.positions = array("q", compress(self.positions, keep))
+        self.days = array("i", compress(self.days, keep))
+        self.dead = 0
+
+    def query(self, transaction_type=None, category=None, date_from=None, date_to=None, text=None):
+        start = bisect_left(self.days, to_day(date_from)) if date_from else 0
+        # Граница "до" включает весь день, поэтому ищем правую границу
+        end = bisect_right(self.days, to_day(date_to)) if date_to else len(self.days)
+        positions = self.positions[start:end]
+
+        # Тип и категорию проверяем масками по колонкам целиком
+        masks = [self.store.alive] if self.dead else []
+        if transaction_type:
+            masks.append(self.store.type_mask(transaction_type))
+        if category:
+            masks.append(self.store.category_mask(category))
+        if text:
+            # Поиск по словам дает такую же маску по колонкам, как фильтр по категории
+            mask = self.search.mask(text)
+            if mask is not None:
+                masks.append(mask)
+        if masks:
+            mask = mask_and(*masks)
+            positions = array("q", compress(positions, map(mask.__getitem__, positions)))
+        return positions
@@ -0,0 +1,339 @@
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from backup import META_KEYS, BackupStore
+from money import normalize_amount
+from perf import timed
+from storage import BINARY_EXTENSIONS, SqliteStorage, open_storage, migrate_json_to_binary, migrate_json_to_sqlite
+from transfer import content_hash, iter_new_transactions, write_records
+
+TRANSACTION_TYPES = ("income", "expense")
+
+
+def default_data():
+    return {
+        "categories": {
+            "income": ["Зарплата", "Фриланс", "Инвестиции", "Подарки"],
+            "expense": ["Еда", "Транспорт", "Жилье", "Развлечения", "Одежда"]
+        },
+        "settings": {
+            "theme": "light"
+        },
+        "next_id": 1
+    }
+
+
+def default_data_file():
+    for data_file in ("finance_data.db", "finance_data.kopb"):
+        if os.path.exists(data_file):
+            return data_file
+    return "finance_data.json"
+
+
+def today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def normalize_date(date):
+    # strptime принимает и даты без ведущих нулей (2024-1-5), а суммы по периодам, фильтры
+    # и сортировка в SQLite опираются на ISO-запись, поэтому дату приводим к ней
+    return datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+
+class Ledger:
+    # Данные и операции над ними без интерфейса: им пользуются и окно, и командная строка
+    def __init__(self, data_file=None):
+        self.data_file = data_file or default_data_file()
+        self.storage = open_storage(self.data_file)
+        self.data = default_data()
+        self.category_sets = {}
+        self._batch = None
+
+    @timed("ledger.load")
+    def load(self):
+        self.data = self.storage.load(self.data)
+        self.index_categories()
+
+    def index_categories(self):
+        # Списки категорий сохраняются как есть, а проверки идут по упорядоченным множествам
+        self.category_sets = {t: dict.fromkeys(self.data["categories"].get(t, [])) for t in TRANSACTION_TYPES}
+        # Старые версии удаляли категории вместе с операциями в них — возвращаем такие категории в списки
+        orphans = [{"type": t, "category": category} for t in TRANSACTION_TYPES
+                   for category in self.category_counts(t) if category not in self.category_sets[t]]
+        self.add_missing_categories(orphans)
+
+    def save_categories(self):
+        self.data["categories"] = {t: list(categories) for t, categories in self.category_sets.items()}
+        self.apply({"op": "categories", "categories": self.data["categories"]})
+
+    def quarantine(self):
+        # Поврежденный файл откладываем в сторону и начинаем с данных по умолчанию
+        broken_file = self.storage.quarantine()
+        self.data = default_data()
+        self.load()
+        return broken_file
+
+    def load_aggregates(self):
+        # Полный пересчет сумм по периодам; обычно они загружаются готовыми вместе с данными
+        self.storage.load_aggregates()
+
+    def apply(self, record):
+        # Внутри пачки изменения копятся и уходят в хранилище одной записью
+        if self._batch is not None:
+            self._batch.append(record)
+            return
+        # Хранилище записывает одно изменение, а не весь файл целиком, и обновляет суммы по периодам
+        self.storage.apply(record)
+
+    @contextmanager
+    def batch(self):
+        # Все изменения блока — одна запись журнала (или одна транзакция SQLite),
+        # одно обновление индекса и сумм. Чтение внутри блока видит данные до пачки
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            # Уже сделанные изменения записываем и при ошибке: категории и счетчик id в памяти уже изменены
+            records, self._batch = self._batch, None
+            if len(records) == 1:
+                self.storage.apply(records[0])
+            elif records:
+                self.storage.apply({"op": "batch", "records": records})
+
+    def allocate_ids(self, count=1):
+        # Счетчик только растет и сохраняется вместе с данными
+        first_id = self.data["next_id"]
+        self.data["next_id"] = first_id + count
+        return range(first_id, first_id + count)
+
+    def add(self, date, transaction_type, category, amount, description=""):
+        if transaction_type not in TRANSACTION_TYPES:
+            raise ValueError(f"Неизвестный тип операции: {transaction_type}")
+        # Суммы по периодам опираются на дату, поэтому проверяем ее формат
+        date = normalize_date(date)
+
+        transaction = {
+            "id": self.allocate_ids()[0],
+            "date": date,
+            "type": transaction_type,
+            "category": category,
+            "amount": normalize_amount(amount),
+            "description": description
+        }
+        self.apply({"op": "add", "transaction": transaction})
+        self.add_missing_categories([transaction])
+        return transaction
+
+    def add_many(self, transactions):
+        for transaction, transaction_id in zip(transactions, self.allocate_ids(len(transactions))):
+            transaction["id"] = transaction_id
+
+        self.apply({"op": "add_many", "transactions": transactions})
+        self.add_missing_categories(transactions)
+        return transactions
+
+    def add_missing_categories(self, transactions):
+        # Новые категории из файла или правки добавляем к существующим
+        missing = dict.fromkeys((t["type"], t["category"]) for t in transactions
+                                if t["category"] not in self.category_sets[t["type"]])
+        for category_type, category in missing:
+            self.category_sets[category_type][category] = None
+        if missing:
+            self.save_categories()
+
+    def delete(self, transaction_id):
+        # Возвращает удаленные операции, чтобы окно убрало их из таблицы без поиска
+        transactions = self.storage.get(transaction_id)
+        self.apply({"op": "delete", "id": transaction_id})
+        return transactions
+
+    def delete_many(self, transaction_ids):
+        removed = []
+        with self.batch():
+            for transaction_id in transaction_ids:
+                removed.extend(self.delete(transaction_id))
+        return removed
+
+    def update_many(self, transaction_ids, **changes):
+        # Массовая правка: пустые значения означают "не менять"
+        changes = {field: value for field, value in changes.items() if value not in (None, "")}
+        if "type" in changes and changes["type"] not in TRANSACTION_TYPES:
+            raise ValueError(f"Неизвестный тип операции: {changes['type']}")
+        if "date" in changes:
+            changes["date"] = normalize_date(changes["date"])
+        if "amount" in changes:
+            changes["amount"] = normalize_amount(changes["amount"])
+
+        updated = []
+        with self.batch():
+            for transaction_id in transaction_ids:
+                for transaction in self.get(transaction_id):
+                    transaction.update(changes)
+                    self.apply({"op": "update", "transaction": transaction})
+                    updated.append(transaction)
+            self.add_missing_categories(updated)
+        return updated
+
+    def get(self, transaction_id):
+        return self.storage.get(transaction_id)
+
+    def count(self):
+        return self.storage.count()
+
+    @timed("query")
+    def query(self, transaction_type=None, category=None, date_from=None, date_to=None, text=None):
+        # text — слова для поиска по описанию и категории, каждое ищется как начало слова
+        return self.storage.query(transaction_type, category, date_from, date_to, text)
+
+    def totals(self, period="all", date=None):
+        return self.storage.aggregates.totals(period, date or today())
+
+    def category_sums(self, transaction_type, period="all", date=None):
+        return self.storage.aggregates.category_sums(transaction_type, period, date or today())
+
+    def series(self, period, date=None):
+        return self.storage.aggregates.series(period, date or today())
+
+    def category_counts(self, category_type):
+        # Счетчики ведут суммы по периодам, они обновляются с каждым изменением
+        return self.storage.aggregates.category_counts(category_type)
+
+    def rollup_rows(self):
+        # Суммы по периодам строками в копейках: их можно сложить с суммами других файлов
+        return list(self.storage.aggregates.rows())
+
+    def add_category(self, category_type, category):
+        category = category.strip()
+        if not category:
+            raise ValueError("Введите название категории")
+        if category in self.category_sets[category_type]:
+            raise ValueError("Такая категория уже существует")
+
+        self.category_sets[category_type][category] = None
+        self.save_categories()
+
+    def remove_categories(self, categories):
+        # Категорию с операциями не удаляем, иначе операции остались бы без категории в списке
+        for category_type, category in categories:
+            count = self.category_counts(category_type).get(category, 0)
+            if count:
+                raise ValueError(f"Категория «{category}» используется в операциях ({count}). "
+                                 "Объедините ее с другой категорией")
+        for category_type, category in categories:
+            self.category_sets[category_type].pop(category, None)
+        self.save_categories()
+
+    def rename_category(self, category_type, old, new, merge=False):
+        # Переименование в существующую категорию — это слияние; возвращает число перенесенных операций
+        new = new.strip()
+        categories = self.category_sets[category_type]
+        if not new:
+            raise ValueError("Введите название категории")
+        if old not in categories:
+            raise ValueError(f"Категория «{old}» не найдена")
+        if new == old:
+            return 0
+        if new in categories and not merge:
+            raise ValueError("Такая категория уже существует")
+
+        count = self.category_counts(category_type).get(old, 0)
+        with self.batch():
+            if count:
+                self.apply({"op": "rename_category", "type": category_type, "old": old, "new": new})
+            # Новое имя встает на место старого, при слиянии остается место целевой категории
+            self.category_sets[category_type] = dict.fromkeys(new if category == old else category
+                                                              for category in categories)
+            self.save_categories()
+        return count
+
+    def merge_categories(self, category_type, sources, target):
+        moved = 0
+        with self.batch():
+            for source in sources:
+                moved += self.rename_category(category_type, source, target, merge=True)
+        return moved
+
+    def set_theme(self, theme):
+        self.data["settings"]["theme"] = theme
+        self.apply({"op": "settings", "settings": self.data["settings"]})
+
+    def replace(self, data):
+        self.data = self.storage.replace(data)
+        self.index_categories()
+
+    def export(self):
+        return self.storage.export()
+
+    def export_rows(self):
+        return self.storage.export_rows()
+
+    def backup_dir(self):
+        # Каталог инкрементных копий по умолчанию — рядом с файлом данных
+        return os.path.splitext(os.path.abspath(self.data_file))[0] + "_backups"
+
+    def backup_meta(self):
+        # Копия категорий и настроек: снимок может писаться в другом потоке
+        return json.loads(json.dumps({key: self.data[key] for key in META_KEYS}))
+
+    def backup(self, directory=None, counter=None):
+        return BackupStore(directory or self.backup_dir()).create(self.backup_meta(), self.export_rows(), counter)
+
+    def restore_backup(self, directory=None, name=None):
+        # Без имени восстанавливается последний снимок
+        store = BackupStore(directory or self.backup_dir())
+        if name is None:
+            snapshots = store.snapshots()
+            if not snapshots:
+                raise ValueError("В каталоге нет резервных копий")
+            name = snapshots[-1][0]
+        self.replace(store.restore(name))
+        return name
+
+    def import_file(self, path, counter=None):
+        # Слияние файла с уже имеющимися операциями без повторов
+        counter = counter if counter is not None else {}
+        counter.update({"bytes": 0, "errors": 0, "duplicates": 0, "added": 0})
+        existing = {content_hash(t) for t in self.export_rows()}
+        for chunk in iter_new_transactions(path, existing, counter):
+            self.add_many(chunk)
+            counter["added"] += len(chunk)
+        return counter
+
+    def export_file(self, path, counter=None):
+        counter = counter if counter is not None else {}
+        counter["rows"] = 0
+        write_records(path, self.export_rows(), counter)
+        return counter
+
+    def migrate_to_sqlite(self):
+        if isinstance(self.storage, SqliteStorage):
+            raise ValueError("Данные уже хранятся в SQLite")
+        return self.migrate(migrate_json_to_sqlite, ".db")
+
+    def migrate_to_binary(self):
+        if isinstance(self.storage, SqliteStorage) or os.path.splitext(self.data_file)[1] in BINARY_EXTENSIONS:
+            raise ValueError("Перенести в двоичный снимок можно только данные в JSON")
+        return self.migrate(migrate_json_to_binary, BINARY_EXTENSIONS[0])
+
+    def migrate(self, convert, extension):
+        self.storage.close()
+        try:
+            new_file = convert(self.data_file, os.path.splitext(self.data_file)[0] + extension)
+        except Exception:
+            # Прежнее хранилище уже закрыто: открываем его заново, чтобы работа продолжилась с ним
+            self.storage = open_storage(self.data_file)
+            self.data = self.storage.load(self.data)
+            raise
+        self.data_file = new_file
+        self.storage = open_storage(new_file)
+        self.data = self.storage.load(self.data)
+        self.index_categories()
+        return new_file
+
+    def close(self):
+        self.storage.close()
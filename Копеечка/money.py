@@ -0,0 +1,27 @@
+import math
+
+# Копеек в рубле
+KOPECKS = 100
+
+# Единица сумм в снимках и базе: файлы без этой отметки хранят суммы в рублях с плавающей точкой
+AMOUNT_UNIT = "kopeck"
+
+
+def to_kopecks(amount):
+    # Рубли из JSON, CSV или поля ввода -> целые копейки. Для сумм с точностью до копейки
+    # ошибка умножения много меньше половины копейки, поэтому округление восстанавливает точное значение
+    amount = float(amount)
+    if not math.isfinite(amount):
+        raise ValueError(f"Недопустимая сумма: {amount}")
+    return round(amount * KOPECKS)
+
+
+def to_rubles(kopecks):
+    # Ближайшее к точной сумме число с плавающей точкой: при выводе с двумя знаками дает те же копейки
+    return kopecks / KOPECKS
+
+
+def normalize_amount(amount):
+    # Сумма в рублях, округленная до копеек, — в таком виде она попадает в журнал и экспорт
+    return to_rubles(to_kopecks(amount))
+
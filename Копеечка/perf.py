@@ -0,0 +1,116 @@
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import threading
+import time
+import tracemalloc
+from functools import wraps
+
+# Сколько строк профиля и мест выделения памяти попадает в отчет
+CAPTURE_TOP = 25
+
+
+class Metrics:
+    # Таймеры и счетчики горячих путей. Выключенные замеры стоят одну проверку флага на вызов
+    def __init__(self):
+        self.enabled = bool(os.environ.get("KOPEECHKA_PROFILE"))
+        # имя -> [вызовов, суммарное время, максимум]
+        self.timers = {}
+        self.counters = {}
+        self.capture = None
+        self._profiler = None
+        self._lock = threading.Lock()
+
+    def timed(self, name):
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.add_time(name, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.capture = None
+
+    def start_capture(self):
+        # Подробный режим: cProfile главного потока и снимки tracemalloc
+        if self._profiler is not None:
+            return
+        tracemalloc.start()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def stop_capture(self):
+        if self._profiler is None:
+            return None
+        self._profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(self._profiler, stream=output).sort_stats("cumulative").print_stats(CAPTURE_TOP)
+        current, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics("lineno")[:CAPTURE_TOP]
+        tracemalloc.stop()
+        self._profiler = None
+
+        self.capture = {
+            "profile": output.getvalue(),
+            "memory_current_kb": current // 1024,
+            "memory_peak_kb": peak // 1024,
+            "allocations": [{"where": str(stat.traceback), "size_kb": stat.size / 1024, "count": stat.count}
+                            for stat in allocations]
+        }
+        return self.capture
+
+    @property
+    def capturing(self):
+        return self._profiler is not None
+
+    def report(self):
+        with self._lock:
+            timers = {name: {"calls": calls, "total_ms": total * 1000, "avg_ms": total / calls * 1000,
+                             "max_ms": longest * 1000}
+                      for name, (calls, total, longest) in self.timers.items()}
+            counters = dict(self.counters)
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "timers": timers,
+            "counters": counters,
+            "capture": self.capture
+        }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=4)
+
+
+# Общие замеры процесса: их пишут и окно, и хранилища, и командная строка
+metrics = Metrics()
+timed = metrics.timed
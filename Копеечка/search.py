@@ -0,0 +1,100 @@
+import re
+from bisect import bisect_left
+
+from columns import mask_and, mask_in, mask_or
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def fold(text):
+    # Регистр сворачивается и для кириллицы, "ё" ищется как "е"
+    return text.casefold().replace("ё", "е")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+def search_text(transaction):
+    # Текст, по которому ищется операция
+    return fold(transaction.get("description", "") + " " + transaction["category"])
+
+
+def fts_query(text):
+    # Запрос FTS5: все слова, каждое как начало слова; None, если слов нет
+    terms = tokenize(text)
+    return " ".join(f'"{term}"*' for term in terms) if terms else None
+
+
+def matches_text(transaction, text):
+    # Каждое слово запроса должно быть началом какого-то слова описания или категории
+    words = tokenize(search_text(transaction))
+    return all(any(word.startswith(term) for word in words) for term in tokenize(text))
+
+
+class TokenIndex:
+    # Обратный индекс по пулу строк: слово -> коды строк, где оно встречается.
+    # Пул только дополняется, поэтому при каждом поиске разбираются лишь новые строки
+    def __init__(self, pool):
+        self.pool = pool
+        self.postings = {}
+        # Отсортированные слова: слова с общим началом идут подряд
+        self.tokens = []
+        self.indexed = 0
+        self.generation = pool.generation
+
+    def update(self):
+        if self.generation != self.pool.generation:
+            # Строки пула переименованы: индекс собирается заново, пул категорий небольшой
+            self.postings = {}
+            self.tokens = []
+            self.indexed = 0
+            self.generation = self.pool.generation
+        values = self.pool.values
+        new_tokens = []
+        for code in range(self.indexed, len(values)):
+            for token in set(tokenize(values[code])):
+                codes = self.postings.get(token)
+                if codes is None:
+                    codes = self.postings[token] = set()
+                    new_tokens.append(token)
+                codes.add(code)
+        self.indexed = len(values)
+        if new_tokens:
+            # Новые слова добавляются одной сортировкой: вставка по одному при сотнях тысяч
+            # разных слов (номера платежей в выписках) квадратична. Timsort сливает готовые серии
+            self.tokens.extend(new_tokens)
+            self.tokens.sort()
+
+    def match(self, prefix):
+        self.update()
+        codes = set()
+        for index in range(bisect_left(self.tokens, prefix), len(self.tokens)):
+            token = self.tokens[index]
+            if not token.startswith(prefix):
+                break
+            codes |= self.postings[token]
+        return codes
+
+
+class TextSearch:
+    # Поиск по описаниям и категориям колоночного хранилища. Слова индексируются по кодам
+    # строк, а строки операций выбираются маской по колонке кодов, как в фильтрах по категории
+    def __init__(self, store):
+        self.store = store
+        self.descriptions = TokenIndex(store.description_pool)
+        self.categories = TokenIndex(store.category_pool)
+
+    def mask(self, text):
+        masks = []
+        for term in tokenize(text):
+            term_masks = []
+            for index, column in ((self.descriptions, self.store.descriptions),
+                                  (self.categories, self.store.categories)):
+                codes = index.match(term)
+                if codes:
+                    term_masks.append(mask_in(column, codes))
+            if not term_masks:
+                return bytes(len(self.store.alive))
+            masks.append(mask_or(*term_masks))
+        return mask_and(*masks) if masks else None
@@ -0,0 +1,185 @@
+import json
+import mmap
+import sys
+from array import array
+from itertools import accumulate, compress
+
+from aggregates import group_rows
+from columns import ColumnStore, StringPool
+from money import to_kopecks
+
+# Сигнатура и версия формата
+MAGIC = b"KOPB\x02\x00\x00\x00"
+# Первая версия хранила суммы в рублях с плавающей точкой
+LEGACY_MAGIC = b"KOPB\x01\x00\x00\x00"
+
+# Колонки фиксированной ширины в порядке следования в файле; суммы — в целых копейках
+COLUMNS = (("ids", "q"), ("days", "i"), ("types", "B"), ("categories", "I"), ("amounts", "q"),
+           ("descriptions", "I"))
+
+
+def padding(size):
+    # Каждая секция начинается с границы 8 байт
+    return -size % 8
+
+
+class MappedStrings:
+    # Таблица строк в отображенном файле: строка декодируется только при обращении к ней
+    def __init__(self, mapping, start, offsets):
+        self.mapping = mapping
+        self.start = start
+        self.offsets = offsets
+        self.mapped = len(offsets) - 1
+        # Строки, добавленные после загрузки, живут в памяти
+        self.extra = []
+
+    def __len__(self):
+        return self.mapped + len(self.extra)
+
+    def __getitem__(self, index):
+        if index >= self.mapped:
+            return self.extra[index - self.mapped]
+        return self.mapping[self.start + self.offsets[index]:self.start + self.offsets[index + 1]].decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, value):
+        self.extra.append(value)
+
+
+class MappedStringPool(StringPool):
+    # Строки снимка не попадают в словарь кодов, поэтому новые совпадающие описания
+    # получают свой код; это дешевле, чем разбирать всю таблицу при загрузке
+    def __init__(self, mapping, start, offsets):
+        super().__init__()
+        self.mapping = mapping
+        self.values = MappedStrings(mapping, start, offsets)
+
+    def encode(self):
+        # Отображенная часть переносится в новый снимок байтами, без декодирования
+        strings = self.values
+        if not isinstance(strings, MappedStrings):
+            return encode_strings(strings)
+        blob = self.mapping[strings.start:strings.start + strings.offsets[-1]]
+        extra = [value.encode("utf-8") for value in strings.extra]
+        offsets = array("Q", strings.offsets)
+        end = offsets[-1]
+        offsets.extend(end + size for size in accumulate(map(len, extra)))
+        return offsets, blob + b"".join(extra)
+
+    def release(self):
+        # Windows не дает заменить отображенный файл: читаем строки в память и закрываем отображение
+        if isinstance(self.values, MappedStrings):
+            self.values = list(self.values)
+            self.mapping.close()
+
+
+def encode_strings(values):
+    parts = [value.encode("utf-8") for value in values]
+    offsets = array("Q", accumulate(map(len, parts), initial=0))
+    return offsets, b"".join(parts)
+
+
+def release_mapping(store):
+    if isinstance(store.description_pool, MappedStringPool):
+        store.description_pool.release()
+
+
+def write_snapshot(f, store, meta):
+    # Удаленные строки в снимок не попадают, колонки выбираются маской живых строк
+    alive = store.alive
+    sections = [(name, array(typecode, compress(getattr(store, name), alive))) for name, typecode in COLUMNS]
+    pool = store.description_pool
+    offsets, blob = pool.encode() if isinstance(pool, MappedStringPool) else encode_strings(pool.values)
+    sections += [("string_offsets", offsets), ("strings", blob)]
+
+    # Суммы по периодам лежат отдельными секциями: при запуске читаются только итоги за все время
+    meta = dict(meta)
+    rollups = group_rows(meta.pop("rollups", []))
+    sections += [("rollups_" + period, json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+                 for period, rows in rollups.items()]
+
+    # Позиции дат не в ISO-формате сдвигаются на число удаленных строк перед ними
+    raw_dates = {alive[:position].count(1): date for position, date in store.raw_dates.items() if alive[position]}
+
+    header = {
+        "byteorder": sys.byteorder,
+        "count": len(sections[0][1]),
+        "types": store.type_pool.values,
+        "categories_pool": store.category_pool.values,
+        "raw_dates": raw_dates,
+        "meta": meta,
+        "sections": {}
+    }
+    # Смещения секций зависят от длины заголовка, поэтому считаем их от его оценки и уточняем
+    position = 0
+    while True:
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        start = len(MAGIC) + 8 + len(header_bytes) + padding(len(header_bytes))
+        if start == position:
+            break
+        position = start
+        for name, section in sections:
+            size = len(section) * section.itemsize if isinstance(section, array) else len(section)
+            header["sections"][name] = [start, size]
+            start += size + padding(size)
+
+    f.write(MAGIC)
+    f.write(len(header_bytes).to_bytes(8, "little"))
+    f.write(header_bytes + bytes(padding(len(header_bytes))))
+    for name, section in sections:
+        data = section.tobytes() if isinstance(section, array) else section
+        f.write(data + bytes(padding(len(data))))
+
+
+def read_snapshot(path):
+    # Колонки копируются из отображения одним memcpy каждая, описания остаются в файле
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    legacy = mapping[:len(MAGIC)] == LEGACY_MAGIC
+    if mapping[:len(MAGIC)] != MAGIC and not legacy:
+        mapping.close()
+        raise ValueError(f"{path}: не двоичный снимок Копеечки")
+    header_size = int.from_bytes(mapping[len(MAGIC):len(MAGIC) + 8], "little")
+    header = json.loads(mapping[len(MAGIC) + 8:len(MAGIC) + 8 + header_size].decode("utf-8"))
+    sections = header["sections"]
+
+    store = ColumnStore()
+    with memoryview(mapping) as view:
+        for name, typecode in COLUMNS + (("string_offsets", "Q"),):
+            offset, size = sections[name]
+            column = array("d" if legacy and name == "amounts" else typecode)
+            column.frombytes(view[offset:offset + size])
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            if column.typecode != typecode:
+                # Суммы первой версии переводятся в копейки; суммы по периодам в ней тоже в рублях,
+                # без отметки единицы в заголовке они будут пересчитаны при загрузке
+                column = array(typecode, map(to_kopecks, column))
+            if name == "string_offsets":
+                offsets = column
+            else:
+                setattr(store, name, column)
+
+    count = header["count"]
+    store.alive = bytearray(b"\x01") * count
+    store.count = count
+    store.raw_dates = {int(position): date for position, date in header["raw_dates"].items()}
+    for pool, values in ((store.type_pool, header["types"]), (store.category_pool, header["categories_pool"])):
+        pool.values = values
+        pool.codes = {value: code for code, value in enumerate(values)}
+    store.description_pool = MappedStringPool(mapping, sections["strings"][0], offsets)
+    # Словарь id -> позиции строится при первом удалении или поиске по id
+    store.unindex_ids()
+
+    def section_loader(name):
+        offset, size = sections[name]
+        return lambda: json.loads(mapping[offset:offset + size].decode("utf-8"))
+
+    meta = header["meta"]
+    meta["rollups"] = section_loader("rollups_all")() if "rollups_all" in sections else []
+    meta["deferred_rollups"] = {name[len("rollups_"):]: section_loader(name) for name in sections
+                                if name.startswith("rollups_") and name != "rollups_all"}
+    return store, meta
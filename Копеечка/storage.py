@@ -0,0 +1,793 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+
+from aggregates import Aggregates, group_rows
+from columns import ColumnStore, Rows
+from index import TransactionIndex
+from money import AMOUNT_UNIT, to_kopecks
+from perf import metrics, timed
+from search import fold, fts_query, matches_text, search_text
+from snapshot import read_snapshot, release_mapping, write_snapshot
+from writebehind import WriteBehind
+
+# Размер журнала, после которого он сворачивается в новый снимок
+COMPACT_THRESHOLD = 4 * 1024 * 1024
+
+# Расширения файлов данных в двоичном формате снимка
+BINARY_EXTENSIONS = (".kopb",)
+
+# Ошибки, по которым файл данных считается поврежденным
+LOAD_ERRORS = (OSError, ValueError, KeyError, sqlite3.DatabaseError)
+
+
+def fsync_dir(path):
+    # На Windows каталоги нельзя открыть для fsync, там хватает os.replace
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data):
+    # Пишем во временный файл и подменяем им основной, чтобы оборванная запись
+    # никогда не оставляла на диске наполовину записанный JSON
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+def atomic_write_binary(path, store, meta):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_snapshot(f, store, meta)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.name == "nt":
+        release_mapping(store)
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+class SqliteRows:
+    # Ленивая выборка SQLite с интерфейсом columns.Rows: хранит только id в порядке даты,
+    # строки окна таблицы читаются запросом по id при обращении к ним
+    FETCH_SIZE = 500
+
+    def __init__(self, storage, ids):
+        self.storage = storage
+        self.id_list = ids
+
+    def __len__(self):
+        return len(self.id_list)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.storage.get_many(self.id_list[item])
+        return self.storage.get(self.id_list[item])[0]
+
+    def __delitem__(self, item):
+        del self.id_list[item]
+
+    def __iter__(self):
+        for start in range(0, len(self.id_list), self.FETCH_SIZE):
+            yield from self.storage.get_many(self.id_list[start:start + self.FETCH_SIZE])
+
+    def insert(self, index, transaction):
+        self.id_list.insert(index, transaction["id"])
+
+    def ids(self):
+        return iter(self.id_list)
+
+    def find(self, transaction):
+        # Id уникальны, поиск по колонке id идет в C
+        try:
+            return self.id_list.index(transaction["id"])
+        except ValueError:
+            return None
+
+
+def open_storage(data_file):
+    extension = os.path.splitext(data_file)[1]
+    if extension in (".db", ".sqlite", ".sqlite3"):
+        return SqliteStorage(data_file)
+    return JournalStorage(data_file, binary=extension in BINARY_EXTENSIONS)
+
+
+class JournalStorage:
+    def __init__(self, data_file, compact_threshold=COMPACT_THRESHOLD, binary=False):
+        self.data_file = data_file
+        # Снимок в JSON или в двоичном формате с колонками фиксированной ширины (snapshot.py)
+        self.binary = binary
+        self.journal_file = data_file + ".journal"
+        self.old_journal_file = self.journal_file + ".old"
+        self.compact_threshold = compact_threshold
+        self.seq = 0
+        self.data = None
+        self.store = None
+        self.index = None
+        self.aggregates = None
+        self._journal = None
+        self._journal_size = 0
+        self._lock = threading.Lock()
+        self._compactor = None
+        # Строки журнала пишутся в фоне пачками, а не с fsync на каждое изменение
+        self._writer = WriteBehind(self._write_lines)
+
+    def load(self, default):
+        data = default
+        snapshot_seq = 0
+        columnar = False
+        if os.path.exists(self.data_file) and self.binary:
+            # Колонки сразу готовы, описания читаются из отображенного файла по мере показа
+            self.store, data = read_snapshot(self.data_file)
+            snapshot_seq = data.pop("journal_seq", 0)
+            columnar = True
+        elif os.path.exists(self.data_file):
+            with open(self.data_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            snapshot_seq = data.pop("journal_seq", 0)
+
+        if "columns" in data:
+            # Снимок текущего формата: колонки собираются целиком
+            self.store = ColumnStore.from_columns(data.pop("columns"))
+            columnar = True
+        elif not columnar:
+            # Снимок старого формата со словарями операций: колонки заполняются построчно
+            self.store = ColumnStore(data.pop("transactions", []))
+        self.data = data
+        self.index = None
+
+        # Суммы по периодам сохраняются в снимке вместе с операциями;
+        # журнал после снимка досчитывает их по одной записи
+        rollups = data.pop("rollups", None)
+        deferred = data.pop("deferred_rollups", {})
+        if data.pop("amount_unit", None) != AMOUNT_UNIT:
+            # Суммы старого формата накоплены в рублях с плавающей точкой и могли разойтись
+            # с операциями; операции уже переведены в копейки, суммы пересчитываются по ним
+            rollups = None
+        self.aggregates = None
+        if rollups is not None:
+            self.aggregates = Aggregates()
+            if isinstance(rollups, dict):
+                # Снимок в JSON хранит периоды раздельно: корзины уже разобраны, но в словари
+                # раскладываются только при первом обращении, как в двоичном снимке
+                deferred = {period: (lambda rows=rows: rows) for period, rows in rollups.items() if period != "all"}
+                rollups = rollups.get("all", [])
+            self.aggregates.load_rows(rollups)
+            for period, loader in deferred.items():
+                self.aggregates.defer(period, loader)
+
+        # Снимок + журнал, оставшийся от прерванного сворачивания, + текущий журнал
+        self.seq = snapshot_seq
+        for path in (self.old_journal_file, self.journal_file):
+            self.seq = max(self.seq, self._replay(path, snapshot_seq))
+        # Снимок в колонках (двоичный или JSON) пишется уже с уникальными id и счетчиком, проверять их не нужно
+        repaired = [] if columnar else self._repair_ids()
+        # Индекс по датам строится при первой выборке, до нее запуск показывает только итоги
+        if self.aggregates is None:
+            # Снимок старого формата: суммы считаем один раз по колонкам и сразу сохраняем
+            self.load_aggregates()
+        if repaired or rollups is None:
+            self.save()
+        return data
+
+    def _repair_ids(self):
+        # Счетчик id хранится в снимке; для старых файлов восстанавливаем его по максимуму,
+        # а повторяющиеся id перенумеровываем
+        next_id = max(self.data.get("next_id", 1), max(self.store.ids, default=0) + 1)
+        duplicates = self.store.duplicate_positions()
+        for position in duplicates:
+            self.store.renumber(position, next_id)
+            next_id += 1
+        self.data["next_id"] = next_id
+        return duplicates
+
+    def _replay(self, path, snapshot_seq):
+        last_seq = 0
+        if not os.path.exists(path):
+            return last_seq
+        valid_size = 0
+        torn = False
+        with open(path, "rb") as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    # Оборванная последняя запись: процесс был убит во время записи.
+                    # Перевод строки пишется последним, поэтому без него строка не сохранена целиком
+                    torn = True
+                    break
+                # Испорченная строка в середине журнала — это не обрыв записи: отрезать ее вместе
+                # со всем, что после нее, значит молча потерять сохраненные изменения
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                    seq = record["seq"]
+                    if seq > snapshot_seq:
+                        self.apply_record(record)
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{path}: поврежденная запись журнала в строке {number}: {e!r}") from e
+                valid_size += len(line)
+                last_seq = seq
+        if torn:
+            # Отрезаем хвост, иначе следующая запись склеится с ним
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+        return last_seq
+
+    def load_aggregates(self):
+        self.aggregates = Aggregates(self.store.daily_sums())
+
+    def quarantine(self):
+        # Поврежденный снимок вместе с журналами откладываем в сторону вместо молчаливой перезаписи:
+        # испорченным может быть и журнал, тогда снимок без него неполон
+        self._writer.close()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        broken_file = self.data_file + ".corrupt"
+        for path in (self.data_file, self.journal_file, self.old_journal_file):
+            if os.path.exists(path):
+                os.replace(path, path + ".corrupt")
+        return broken_file
+
+    def apply_record(self, record):
+        first_new = len(self.store.ids)
+        added = []
+        removed = []
+        self._apply_change(record, added, removed)
+
+        # Индекс обновляется один раз на запись, даже если в ней пачка изменений;
+        # во время загрузки он строится один раз после чтения журнала
+        if self.index is not None:
+            for position in removed:
+                if position < first_new:
+                    self.index.remove(position)
+            self.index.add_many([position for position in added if self.store.alive[position]])
+
+    def _apply_change(self, record, added, removed):
+        op = record["op"]
+        if op in ("add", "add_many"):
+            transactions = [record["transaction"]] if op == "add" else record["transactions"]
+            self._add(transactions, added)
+        elif op == "delete":
+            self._delete(record["id"], removed)
+        elif op == "update":
+            # Правка — это замена строки с тем же id
+            if record["transaction"]["id"] in self.store.by_id:
+                self._delete(record["transaction"]["id"], removed)
+                self._add([record["transaction"]], added)
+        elif op == "rename_category":
+            # Индекс по датам хранит позиции, а категория берется из колонки, поэтому он не меняется.
+            # Суммы знают, есть ли категория у другого типа; без них строки перебираются
+            exclusive = self.aggregates is not None and self.aggregates.category_types(record["old"]) <= {record["type"]}
+            self.store.rename_category(record["type"], record["old"], record["new"], exclusive)
+            if self.aggregates is not None:
+                self.aggregates.rename_category(record["type"], record["old"], record["new"])
+        elif op == "batch":
+            for change in record["records"]:
+                self._apply_change(change, added, removed)
+        elif op in ("categories", "settings"):
+            self.data[op] = record[op]
+        else:
+            raise ValueError(f"Неизвестная операция журнала: {op}")
+
+    def _add(self, transactions, added):
+        added.extend(self.store.append(t) for t in transactions)
+        if self.aggregates is not None:
+            for transaction in transactions:
+                self.aggregates.add(transaction)
+        # Id не выдаются повторно, даже если удалить последнюю операцию
+        last_id = max((t["id"] for t in transactions), default=0)
+        self.data["next_id"] = max(self.data.get("next_id", 1), last_id + 1)
+
+    def _delete(self, transaction_id, removed):
+        if self.aggregates is not None:
+            for transaction in self.get(transaction_id):
+                self.aggregates.remove(transaction)
+        removed.extend(self.store.delete(transaction_id))
+
+    def apply(self, record):
+        self.apply_record(record)
+        self.append(record)
+
+    def append(self, record):
+        # Строка готовится сразу: запись может измениться в памяти до того, как попадет на диск.
+        # seq меняется только в вызывающем потоке, поэтому блокировку файла, которую фоновый
+        # поток держит на время fsync, здесь не берем
+        self.seq += 1
+        line = json.dumps(dict(record, seq=self.seq), ensure_ascii=False) + "\n"
+        self._writer.put(line)
+
+        if self._journal_size >= self.compact_threshold:
+            self.compact()
+
+    @timed("save_data")
+    def _write_lines(self, lines):
+        # Вызывается фоновым потоком: все накопленные изменения — одна запись и один fsync
+        with self._lock:
+            if self._journal is None:
+                self._journal = open(self.journal_file, "a", encoding="utf-8")
+            self._journal.write("".join(lines))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_size = self._journal.tell()
+        metrics.count("journal_lines", len(lines))
+
+    def flush(self):
+        self._writer.flush()
+
+    def compact(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        # В снимок попадет все, что есть в памяти, поэтому отложенные строки
+        # должны оказаться в сворачиваемом журнале, иначе они применятся дважды
+        self.flush()
+        with self._lock:
+            # Отцепляем текущий журнал, новые записи пойдут в свежий файл
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._journal_size = 0
+            if os.path.exists(self.journal_file):
+                if os.path.exists(self.old_journal_file):
+                    # Прошлое сворачивание не завершилось — дописываем журнал к старому
+                    with open(self.journal_file, "r", encoding="utf-8") as src, \
+                            open(self.old_journal_file, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, self.old_journal_file)
+
+            # Копия колонок дешевая; словари операций собираются уже в фоне
+            snapshot = {
+                "categories": json.loads(json.dumps(self.data["categories"])),
+                "settings": dict(self.data["settings"]),
+                "next_id": self.data["next_id"],
+                "rollups": list(self.aggregates.rows()),
+                "journal_seq": self.seq
+            }
+            self._compactor = threading.Thread(target=self._write_snapshot, args=(self.store.copy(), snapshot),
+                                               daemon=True)
+            self._compactor.start()
+
+    def _write_file(self, store, snapshot):
+        # Колонка amounts и суммы по периодам пишутся в целых копейках; отметка единицы отличает
+        # такой снимок от старых, где суммы операций хранились в рублях
+        snapshot = dict(snapshot, amount_unit=AMOUNT_UNIT)
+        if self.binary:
+            atomic_write_binary(self.data_file, store, snapshot)
+        else:
+            atomic_write_json(self.data_file, dict(snapshot, rollups=group_rows(snapshot["rollups"]),
+                                                   columns=store.to_columns()))
+
+    @timed("compact")
+    def _write_snapshot(self, store, snapshot):
+        self._write_file(store, snapshot)
+        if os.path.exists(self.old_journal_file):
+            os.remove(self.old_journal_file)
+
+    @timed("save_snapshot")
+    def save(self):
+        # Полная запись: снимок заменяет и журнал
+        self.wait()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._write_file(self.store, dict(self.data, rollups=list(self.aggregates.rows()), journal_seq=self.seq))
+            self._journal_size = 0
+            for path in (self.journal_file, self.old_journal_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def replace(self, data):
+        data = dict(data)
+        if os.name == "nt":
+            # Старые выборки могут держать отображение заменяемого файла открытым
+            release_mapping(self.store)
+        self.store = ColumnStore(data.pop("transactions"))
+        self.data = data
+        self._repair_ids()
+        self.index = None
+        self.load_aggregates()
+        self.save()
+        return data
+
+    def count(self):
+        return self.store.count
+
+    def get(self, transaction_id):
+        return [self.store.row(position) for position in self.store.by_id.get(transaction_id, [])]
+
+    def query(self, transaction_type=None, category=None, date_from=None, date_to=None, text=None):
+        if self.index is None:
+            self.index = TransactionIndex(self.store)
+        return Rows(self.store, self.index.query(transaction_type, category, date_from, date_to, text))
+
+    def export(self):
+        return dict(self.data, transactions=self.store.rows())
+
+    def export_rows(self):
+        # Копия колонок, которую можно безопасно обходить из другого потока
+        return self._dated_rows(self.store.copy())
+
+    @staticmethod
+    def _dated_rows(store):
+        # Строки по дате, как выгрузка SQLite: резервная копия пишет месяцы по одному.
+        # Сортируются только позиции, и уже в потоке, который обходит выгрузку
+        for position in sorted(store.positions(), key=store.days.__getitem__):
+            yield store.row(position)
+
+    def wait(self):
+        self.flush()
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def close(self):
+        self._writer.close()
+        self.wait()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+class SqliteStorage:
+    META_KEYS = ("categories", "settings", "next_id")
+    # Суммы хранятся в целых копейках, наружу выдаются в рублях
+    SELECT = "SELECT id, date, type, category, amount / 100.0 AS amount, description FROM transactions"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            description TEXT NOT NULL DEFAULT ''
+        );
+        -- Индекс по (date, id) покрывает выборку id в порядке таблицы без сортировки;
+        -- индекс только по дате из старых баз им заменяется
+        DROP INDEX IF EXISTS idx_transactions_date;
+        CREATE INDEX IF NOT EXISTS idx_transactions_date_id ON transactions (date, id);
+        CREATE INDEX IF NOT EXISTS idx_transactions_type_category ON transactions (type, category);
+        CREATE INDEX IF NOT EXISTS idx_transactions_id ON transactions (id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            count INTEGER NOT NULL
+        );
+    """
+    # Перевод базы старого формата (рубли в колонке REAL) в копейки одной транзакцией.
+    # Суммы по периодам в рублях выбрасываются и пересчитываются по новым колонкам
+    CONVERT_AMOUNTS = """
+        BEGIN;
+        ALTER TABLE transactions RENAME TO transactions_rubles;
+        DROP INDEX IF EXISTS idx_transactions_date_id;
+        DROP INDEX IF EXISTS idx_transactions_type_category;
+        DROP INDEX IF EXISTS idx_transactions_id;
+        DROP TABLE IF EXISTS rollups;
+        """ + SCHEMA + """
+        INSERT INTO transactions (id, date, type, category, amount, description)
+            SELECT id, date, type, category, CAST(ROUND(amount * 100) AS INTEGER), description
+            FROM transactions_rubles ORDER BY rowid;
+        DROP TABLE transactions_rubles;
+        DELETE FROM meta WHERE key = 'rollups_seq';
+        INSERT OR REPLACE INTO meta (key, value) VALUES ('amount_unit', '"kopeck"');
+        COMMIT;
+    """
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.conn = None
+        self.next_id = 1
+        self.seq = 0
+        self.aggregates = None
+        self.text_index = False
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.data_file)
+        self.conn.row_factory = sqlite3.Row
+        # WAL переживает аварийное завершение и не блокирует чтение во время записи
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        if self._read_meta_value("amount_unit", None) != AMOUNT_UNIT:
+            self.conn.executescript(self.CONVERT_AMOUNTS)
+        # Полнотекстовый индекс: rowid — id операции, текст уже приведен к нижнему регистру
+        # и без "ё", поэтому поиск совпадает с поиском по колонкам
+        self.conn.create_function("fold", 1, fold, deterministic=True)
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'transactions_fts'").fetchone() is not None
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(text)")
+            self.text_index = True
+        except sqlite3.OperationalError:
+            # SQLite собран без FTS5: ищем перебором выборки
+            self.text_index = False
+        return not exists
+
+    def load(self, default):
+        new_text_index = self._connect()
+        data = {}
+        for key in ("categories", "settings"):
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            data[key] = json.loads(row["value"]) if row else default[key]
+        self.next_id = self._read_meta_value("next_id", 1)
+        self.seq = self._read_meta_value("seq", 0)
+        with self.conn:
+            self._repair_ids()
+            data["next_id"] = self.next_id
+            self._write_meta(data)
+            if new_text_index:
+                self._rebuild_text_index()
+
+        # Суммы по периодам записываются при закрытии; если после этого база менялась
+        # (например, программа упала), пересчитываем их
+        if self._read_meta_value("rollups_seq", -1) == self.seq:
+            self.aggregates = Aggregates()
+            self.aggregates.load_rows(self.conn.execute(
+                "SELECT period, bucket, type, category, amount, count FROM rollups"))
+        else:
+            self.load_aggregates()
+        return data
+
+    def _read_meta_value(self, key, default):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def _write_meta_value(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def load_aggregates(self):
+        self.aggregates = Aggregates(self.daily_sums())
+
+    def save_aggregates(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM rollups")
+            self.conn.executemany("INSERT INTO rollups (period, bucket, type, category, amount, count) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", self.aggregates.rows())
+            self._write_meta_value("rollups_seq", self.seq)
+
+    def _repair_ids(self):
+        # Счетчик id для старых баз восстанавливаем по максимуму, повторяющиеся id перенумеровываем
+        max_id = self.conn.execute("SELECT MAX(id) FROM transactions").fetchone()[0] or 0
+        self.next_id = max(self.next_id, max_id + 1)
+        duplicates = self.conn.execute(
+            "SELECT rowid FROM transactions WHERE rowid NOT IN (SELECT MIN(rowid) FROM transactions GROUP BY id)"
+        ).fetchall()
+        for (rowid,) in duplicates:
+            self.conn.execute("UPDATE transactions SET id = ? WHERE rowid = ?", (self.next_id, rowid))
+            self.next_id += 1
+
+    def _rebuild_text_index(self):
+        if self.text_index:
+            self.conn.execute("DELETE FROM transactions_fts")
+            self.conn.execute("INSERT INTO transactions_fts (rowid, text) "
+                              "SELECT id, fold(description || ' ' || category) FROM transactions")
+
+    def _write_meta(self, data):
+        for key in self.META_KEYS:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              (key, json.dumps(data[key], ensure_ascii=False)))
+
+    def _insert(self, transactions, index_text=True):
+        self.conn.executemany(
+            "INSERT INTO transactions (id, date, type, category, amount, description) VALUES (?, ?, ?, ?, ?, ?)",
+            ((t["id"], t["date"], t["type"], t["category"], to_kopecks(t["amount"]), t.get("description", ""))
+             for t in transactions))
+        if index_text and self.text_index:
+            self.conn.executemany("INSERT OR REPLACE INTO transactions_fts (rowid, text) VALUES (?, ?)",
+                                  ((t["id"], search_text(t)) for t in transactions))
+        # Id не выдаются повторно, даже если удалить последнюю операцию
+        last_id = max((t["id"] for t in transactions), default=0)
+        if last_id >= self.next_id:
+            self.next_id = last_id + 1
+            self._write_meta_value("next_id", self.next_id)
+
+    @timed("save_data")
+    def apply(self, record):
+        # Пачка изменений записывается одной транзакцией
+        with self.conn:
+            self._apply_change(record)
+            # Номер изменения показывает, отстают ли сохраненные суммы от данных
+            self.seq += 1
+            self._write_meta_value("seq", self.seq)
+
+    def _apply_change(self, record):
+        op = record["op"]
+        if op in ("add", "add_many"):
+            transactions = [record["transaction"]] if op == "add" else record["transactions"]
+            self._insert(transactions)
+            for transaction in transactions:
+                self.aggregates.add(transaction)
+        elif op == "delete":
+            for transaction in self.get(record["id"]):
+                self.aggregates.remove(transaction)
+            self.conn.execute("DELETE FROM transactions WHERE id = ?", (record["id"],))
+            if self.text_index:
+                self.conn.execute("DELETE FROM transactions_fts WHERE rowid = ?", (record["id"],))
+        elif op == "update":
+            transaction = record["transaction"]
+            old_transactions = self.get(transaction["id"])
+            if not old_transactions:
+                return
+            for old in old_transactions:
+                self.aggregates.remove(old)
+            self.aggregates.add(transaction)
+            self.conn.execute("UPDATE transactions SET date = ?, type = ?, category = ?, amount = ?, description = ? "
+                              "WHERE id = ?", (transaction["date"], transaction["type"], transaction["category"],
+                                               to_kopecks(transaction["amount"]), transaction["description"],
+                                               transaction["id"]))
+            if self.text_index:
+                self.conn.execute("INSERT OR REPLACE INTO transactions_fts (rowid, text) VALUES (?, ?)",
+                                  (transaction["id"], search_text(transaction)))
+        elif op == "rename_category":
+            # Строки категории находит индекс по (type, category)
+            self.conn.execute("UPDATE transactions SET category = ? WHERE type = ? AND category = ?",
+                              (record["new"], record["type"], record["old"]))
+            if self.text_index:
+                self.conn.execute("INSERT OR REPLACE INTO transactions_fts (rowid, text) "
+                                  "SELECT id, fold(description || ' ' || category) FROM transactions "
+                                  "WHERE type = ? AND category = ?", (record["type"], record["new"]))
+            self.aggregates.rename_category(record["type"], record["old"], record["new"])
+        elif op == "batch":
+            for change in record["records"]:
+                self._apply_change(change)
+        elif op in ("categories", "settings"):
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              (op, json.dumps(record[op], ensure_ascii=False)))
+
+    def replace(self, data):
+        with self.conn:
+            self.conn.execute("DELETE FROM transactions")
+            self.next_id = data.get("next_id", 1)
+            # В копии старого формата id могут повторяться, поэтому текст индексируем после перенумерации
+            self._insert(data["transactions"], index_text=False)
+            self._repair_ids()
+            self._rebuild_text_index()
+            data = {"categories": data["categories"], "settings": data["settings"], "next_id": self.next_id}
+            self._write_meta(data)
+            self.seq += 1
+            self._write_meta_value("seq", self.seq)
+        self.load_aggregates()
+        return data
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def get(self, transaction_id):
+        rows = self.conn.execute(self.SELECT + " WHERE id = ?", (transaction_id,))
+        return [dict(row) for row in rows]
+
+    def query(self, transaction_type=None, category=None, date_from=None, date_to=None, text=None):
+        conditions = []
+        params = []
+        for column, operator, value in (("type", "=", transaction_type), ("category", "=", category),
+                                        ("date", ">=", date_from), ("date", "<=", date_to)):
+            if value:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        match = fts_query(text) if text else None
+        if match and self.text_index:
+            conditions.append("id IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?)")
+            params.append(match)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        if match and not self.text_index:
+            # Без FTS5 текст проверяется в Python по полным строкам
+            rows = self.conn.execute(self.SELECT + where + " ORDER BY date, id", params)
+            return SqliteRows(self, array("q", (row["id"] for row in map(dict, rows) if matches_text(row, text))))
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute("SELECT id FROM transactions" + where + " ORDER BY date, id", params)
+        return SqliteRows(self, array("q", (row[0] for row in cursor)))
+
+    def get_many(self, transaction_ids):
+        # Строки по списку id в том же порядке; в запрос идет не больше FETCH_SIZE параметров за раз
+        rows = {}
+        for start in range(0, len(transaction_ids), SqliteRows.FETCH_SIZE):
+            chunk = transaction_ids[start:start + SqliteRows.FETCH_SIZE]
+            for row in self.conn.execute(self.SELECT + f" WHERE id IN ({','.join('?' * len(chunk))})", tuple(chunk)):
+                rows[row["id"]] = dict(row)
+        return [rows[transaction_id] for transaction_id in transaction_ids if transaction_id in rows]
+
+    def daily_sums(self):
+        return self.conn.execute(
+            "SELECT date, type, category, SUM(amount), COUNT(*) FROM transactions GROUP BY date, type, category"
+        ).fetchall()
+
+    def export(self):
+        data = {"transactions": list(self.query())}
+        for key in self.META_KEYS:
+            data[key] = self._read_meta_value(key, None)
+        return data
+
+    def export_rows(self, chunk_size=5000):
+        # Отдельное соединение: выгрузка идет в рабочем потоке
+        conn = sqlite3.connect(self.data_file)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(self.SELECT + " ORDER BY date, id")
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+
+    def quarantine(self):
+        # Суммы поврежденной базы не сохраняем
+        self.aggregates = None
+        self.close()
+        broken_file = self.data_file + ".corrupt"
+        os.replace(self.data_file, broken_file)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.data_file + suffix):
+                os.remove(self.data_file + suffix)
+        return broken_file
+
+    def close(self):
+        if self.conn is not None:
+            if self.aggregates is not None:
+                self.save_aggregates()
+            self.conn.close()
+            self.conn = None
+
+
+def migrate_json_to_binary(json_file, binary_file):
+    # Разовый перенос finance_data.json (вместе с журналом) в двоичный снимок
+    if not os.path.exists(json_file):
+        raise FileNotFoundError(json_file)
+    source = JournalStorage(json_file)
+    source.load(None)
+    data = source.export()
+    source.close()
+
+    target = JournalStorage(binary_file, binary=True)
+    target.load(dict(data, transactions=[]))
+    target.replace(data)
+    target.close()
+    return binary_file
+
+
+def migrate_json_to_sqlite(json_file, db_file):
+    # Разовый перенос finance_data.json или двоичного снимка (вместе с журналом) в базу SQLite
+    if not os.path.exists(json_file):
+        raise FileNotFoundError(json_file)
+    source = JournalStorage(json_file, binary=os.path.splitext(json_file)[1] in BINARY_EXTENSIONS)
+    source.load(None)
+    data = source.export()
+    source.close()
+
+    target = SqliteStorage(db_file)
+    target.load(data)
+    target.replace(data)
+    target.close()
+    return db_file
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Использование: python storage.py finance_data.json finance_data.db")
+        sys.exit(1)
+    migrate_json_to_sqlite(sys.argv[1], sys.argv[2])
@@ -0,0 +1,157 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+from datetime import datetime
+
+from columns import ColumnStore
+from money import normalize_amount
+
+# Сколько записей обрабатывается и применяется за один раз
+CHUNK_SIZE = 5000
+
+FIELDS = ("id", "date", "type", "category", "amount", "description")
+
+# Названия колонок в выгрузках банков и в наших собственных файлах
+COLUMN_ALIASES = {
+    "date": "date", "дата": "date", "дата операции": "date", "дата платежа": "date",
+    "type": "type", "тип": "type", "тип операции": "type",
+    "category": "category", "категория": "category",
+    "amount": "amount", "сумма": "amount", "сумма операции": "amount", "сумма платежа": "amount",
+    "description": "description", "описание": "description", "назначение платежа": "description",
+    "комментарий": "description"
+}
+
+TYPE_ALIASES = {"income": "income", "доход": "income", "expense": "expense", "расход": "expense"}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d.%m.%y", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S",
+                "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M")
+
+DEFAULT_CATEGORY = "Прочее"
+
+
+def content_hash(transaction):
+    # Дубликат — та же дата, сумма, категория и описание, независимо от id
+    key = "\x1f".join((transaction["date"], f"{float(transaction['amount']):.2f}",
+                       transaction["category"], transaction.get("description", "")))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+
+def parse_date(value):
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    raise ValueError(f"Неизвестный формат даты: {value}")
+
+
+def parse_amount(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    # "1 234,56" и "-1234.56" из банковских выписок
+    return float(value.replace("\xa0", "").replace(" ", "").replace(",", "."))
+
+
+def normalize_record(raw):
+    record = {}
+    for key, value in raw.items():
+        field = COLUMN_ALIASES.get(str(key).strip().lower())
+        if field and value not in (None, ""):
+            record[field] = value
+
+    amount = parse_amount(record["amount"])
+    transaction_type = TYPE_ALIASES.get(str(record.get("type", "")).strip().lower())
+    if transaction_type is None:
+        # В выписках тип задается знаком суммы
+        transaction_type = "expense" if amount < 0 else "income"
+
+    return {
+        "date": parse_date(str(record["date"])),
+        "type": transaction_type,
+        "category": str(record.get("category", DEFAULT_CATEGORY)).strip(),
+        "amount": normalize_amount(abs(amount)),
+        "description": str(record.get("description", "")).strip()
+    }
+
+
+def read_lines(path, counter):
+    # Читаем файл построчно и считаем байты, чтобы показывать прогресс
+    with open(path, "rb") as f:
+        for line in f:
+            counter["bytes"] += len(line)
+            try:
+                yield line.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                # Выгрузки многих банков до сих пор в cp1251
+                yield line.decode("cp1251")
+
+
+def read_records(path, counter):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        # Полный документ приложения: поток невозможен, читаем целиком
+        with open(path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        # Файл данных приложения хранит операции колонками, экспорт и резервные копии — словарями
+        if "columns" in document:
+            records = ColumnStore.from_columns(document["columns"]).rows()
+        else:
+            records = document["transactions"]
+        counter["bytes"] = os.path.getsize(path)
+        yield from records
+    elif extension in (".jsonl", ".ndjson"):
+        for line in read_lines(path, counter):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Испорченная строка — ошибка одной записи, как плохая строка CSV
+                    yield None
+    else:
+        lines = read_lines(path, counter)
+        header = next(lines, "")
+        delimiter = max(";,\t", key=header.count)
+        yield from csv.DictReader(itertools.chain([header], lines), delimiter=delimiter)
+
+
+def iter_new_transactions(path, existing, counter):
+    # Отдает пачки новых операций; existing — множество хешей уже известных
+    chunk = []
+    for raw in read_records(path, counter):
+        if not isinstance(raw, dict):
+            counter["errors"] += 1
+            continue
+        try:
+            transaction = normalize_record(raw)
+        except (KeyError, ValueError):
+            counter["errors"] += 1
+            continue
+        digest = content_hash(transaction)
+        if digest in existing:
+            counter["duplicates"] += 1
+            continue
+        existing.add(digest)
+        chunk.append(transaction)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_records(path, rows, counter):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if extension in (".jsonl", ".ndjson"):
+            for row in rows:
+                f.write(json.dumps({field: row[field] for field in FIELDS}, ensure_ascii=False) + "\n")
+                counter["rows"] += 1
+        else:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for row in rows:
+                writer.writerow([row[field] for field in FIELDS])
+                counter["rows"] += 1
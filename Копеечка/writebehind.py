@@ -0,0 +1,94 @@
+import threading
+import time
+
+# Пауза без изменений, после которой накопленное уходит на диск
+WRITE_DELAY = 0.5
+# Дольше этого изменения не ждут на диск даже при непрерывном потоке правок
+WRITE_MAX_DELAY = 2.0
+
+
+class WriteBehind:
+    # Отложенная запись: изменения копятся в памяти, а фоновый поток пишет их одной пачкой,
+    # когда правки затихли на delay секунд или с первой из них прошло max_delay
+    def __init__(self, write, delay=WRITE_DELAY, max_delay=WRITE_MAX_DELAY):
+        self.write = write
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = []
+        self._first = 0
+        self._last = 0
+        self._writing = False
+        self._flushing = 0
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def put(self, item):
+        with self._cond:
+            now = time.monotonic()
+            if not self._pending:
+                self._first = now
+            self._last = now
+            self._pending.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                # После ошибки записи повтор ждет паузы даже во время flush, чтобы не крутиться впустую
+                while (not self._flushing or self._error is not None) and not self._closed:
+                    deadline = min(self._last + self.delay, self._first + self.max_delay)
+                    now = time.monotonic()
+                    if now >= deadline:
+                        break
+                    self._cond.wait(deadline - now)
+                items, self._pending = self._pending, []
+                self._writing = True
+
+            error = None
+            try:
+                self.write(items)
+            except Exception as e:
+                error = e
+
+            with self._cond:
+                self._writing = False
+                if error is not None:
+                    # Несохраненное возвращаем в начало очереди, ошибку отдаст flush
+                    self._pending[:0] = items
+                    self._error = error
+                    self._first = self._last = time.monotonic()
+                self._cond.notify_all()
+
+    def flush(self):
+        # Синхронно дописывает все накопленное; ошибка записи поднимается здесь
+        with self._cond:
+            self._error = None
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while (self._pending or self._writing) and self._error is None:
+                    self._cond.wait()
+                error, self._error = self._error, None
+            finally:
+                self._flushing -= 1
+        if error is not None:
+            raise error
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._closed = False